@@ -0,0 +1,303 @@
+'''
+Epidemic modelling
+
+Benchmarks for the simulations in sir.py.  Every case is run on a
+randomly generated city and reported as the time spent per person-day
+simulated and the peak memory traced while running, in JSON, so that
+the results of two commits can be compared with --compare.
+
+The cases call sir.py through its original list-of-strings functions,
+so the same benchmarks run against every commit.  Engines and draw
+modes are only benchmarked when the sir.py being run offers them.
+'''
+
+import contextlib
+import inspect
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import click
+import numpy as np
+
+import sir
+
+SIZES = [10 ** k for k in range(2, 8)]
+INFECTED_FRACTIONS = [0.001, 0.01, 0.1]
+DAYS_CONTAGIOUS = [2, 5]
+TRIAL_COUNTS = [10, 100]
+INFECTION_RATE = 0.5
+
+# The average task is only benchmarked while the trials x people matrix
+# it advances stays below this many cells.
+MAX_AVERAGE_CELLS = 10 ** 7
+
+# The optional keyword arguments of run_simulation in the sir.py being
+# benchmarked, and the engines and draw modes it offers.
+SIMULATION_PARAMETERS = inspect.signature(sir.run_simulation).parameters
+ENGINES = (list(getattr(sir, "ENGINES", []))
+           if "engine" in SIMULATION_PARAMETERS else [])
+DRAW_MODES = (list(getattr(sir, "DRAW_MODES", []))
+              if "draws" in SIMULATION_PARAMETERS else [])
+
+
+def make_city(num_people, infected_fraction, seed):
+    '''
+    Generate a city with a given fraction of infected people, at least
+    one, and everyone else susceptible.
+
+    Inputs:
+      num_people (int): the number of people in the city
+      infected_fraction (float): the fraction of people infected
+      seed (int): the seed used to place the infected people
+
+    Returns (list of strings): the state of all people in the city
+    '''
+    rng = np.random.default_rng(seed)
+    city = ["S"] * num_people
+    num_infected = max(1, int(num_people * infected_fraction))
+    for position in rng.choice(num_people, num_infected,
+                               replace=False).tolist():
+        city[position] = "I0"
+
+    return city
+
+
+def benchmark_cases(max_size, engines, draws, max_num_days):
+    '''
+    List the cases to benchmark, for every city size, infected fraction
+    and days contagious: simulate_one_day, a single simulation with the
+    default engine and with every engine asked for, and the average
+    over a number of trials.
+
+    Inputs:
+      max_size (int): the largest city to benchmark
+      engines (list of strings): the engines to benchmark, from ENGINES
+      draws (string): the draw mode to use, from DRAW_MODES, or None for
+        the default of run_simulation
+      max_num_days (int): the maximum days of every simulation
+
+    Returns (list of dicts): the parameters of each case
+    '''
+    cases = []
+    for num_people in [size for size in SIZES if size <= max_size]:
+        for infected_fraction in INFECTED_FRACTIONS:
+            for days_contagious in DAYS_CONTAGIOUS:
+                params = {"num_people": num_people,
+                          "infected_fraction": infected_fraction,
+                          "days_contagious": days_contagious,
+                          "max_num_days": max_num_days, "draws": draws,
+                          "engine": None, "num_trials": 1}
+                cases.append(dict(params, task="day", max_num_days=1,
+                                  draws=None))
+                for engine in [None] + engines:
+                    cases.append(dict(params, task="single", engine=engine))
+                for num_trials in TRIAL_COUNTS:
+                    if num_people * num_trials <= MAX_AVERAGE_CELLS:
+                        cases.append(dict(params, task="average",
+                                          num_trials=num_trials))
+    return cases
+
+
+def case_key(case):
+    '''
+    Returns (string): a name for a case that is the same across runs
+    '''
+    return ("{task}/{engine}/n={num_people}/infected={infected_fraction}"
+            "/contagious={days_contagious}/trials={num_trials}"
+            "/days={max_num_days}/draws={draws}"
+            .format(**dict(case, engine=case["engine"] or "default",
+                           draws=case["draws"] or "default")))
+
+
+def simulation_options(case):
+    '''
+    Returns (dict): the optional keyword arguments of run_simulation
+      that a case sets
+    '''
+    options = {}
+    if case["engine"] is not None:
+        options["engine"] = case["engine"]
+    if case["draws"] is not None:
+        options["draws"] = case["draws"]
+    return options
+
+
+def run_case(case, city, seed):
+    '''
+    Run a case once.
+
+    Inputs:
+      case (dict): the parameters of the case
+      city (list of strings): the city of the case
+      seed (int): the random seed of the simulation
+
+    Returns (int): the number of person-days simulated, or None for the
+      average task, whose days are counted by count_person_days
+    '''
+    if case["task"] == "day":
+        sir.simulate_one_day(city, INFECTION_RATE, case["days_contagious"])
+        return len(city)
+    if case["task"] == "single":
+        _, num_days = sir.run_simulation(
+            city, seed, case["max_num_days"], INFECTION_RATE,
+            case["days_contagious"], **simulation_options(case))
+        return len(city) * num_days
+
+    if case["draws"] is None:
+        sir.calc_avg_num_newly_infected(
+            city, seed, case["max_num_days"], INFECTION_RATE,
+            case["days_contagious"], case["num_trials"])
+    else:
+        sir.calc_avg_num_newly_infected(
+            city, seed, case["max_num_days"], INFECTION_RATE,
+            case["days_contagious"], case["num_trials"], draws=case["draws"])
+    return None
+
+
+def count_person_days(case, city, seed):
+    '''
+    Count the person-days simulated by the trials of the average task,
+    which are seeded seed, seed + 1, ... like single simulations.
+
+    Inputs:
+      case (dict): the parameters of the case
+      city (list of strings): the city of the case
+      seed (int): the random seed of the first trial
+
+    Returns (int): the number of person-days simulated
+    '''
+    total = 0
+    for trial in range(case["num_trials"]):
+        _, num_days = sir.run_simulation(
+            city, seed + trial, case["max_num_days"], INFECTION_RATE,
+            case["days_contagious"], **simulation_options(case))
+        total = total + len(city) * num_days
+    return total
+
+
+def benchmark_case(case, repeat, seed):
+    '''
+    Time a case, keeping the fastest of repeat runs, and measure its peak
+    memory in a separate run, since tracing allocations slows it down.
+
+    Inputs:
+      case (dict): the parameters of the case
+      repeat (int): the number of timed runs
+      seed (int): the random seed of every run
+
+    Returns (dict): the case with its results
+    '''
+    city = make_city(case["num_people"], case["infected_fraction"], seed)
+    # Anything sir.py prints would end up in the JSON results.
+    with contextlib.redirect_stdout(sys.stderr):
+        seconds = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            person_days = run_case(case, city, seed)
+            seconds = min(seconds, time.perf_counter() - start)
+        if person_days is None:
+            person_days = count_person_days(case, city, seed)
+
+        tracemalloc.start()
+        try:
+            run_case(case, city, seed)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return dict(case, seconds=seconds, person_days=person_days,
+                seconds_per_person_day=seconds / max(person_days, 1),
+                peak_memory_bytes=peak_memory)
+
+
+def git_commit():
+    '''
+    Returns (string): the commit being benchmarked, or None outside of a
+      git checkout
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new):
+    '''
+    Compare the cases two benchmark runs have in common.
+
+    Inputs:
+      old (dict): the earlier benchmark results
+      new (dict): the later benchmark results
+
+    Returns (list of (string, float, float) tuples): the key of each
+      common case, how many times faster and how many times less memory
+      it takes in the later run.
+    '''
+    old_results = {case_key(result): result for result in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        before = old_results.get(case_key(result))
+        if before is not None:
+            comparison.append((
+                case_key(result),
+                before["seconds_per_person_day"]
+                / max(result["seconds_per_person_day"], 1e-12),
+                before["peak_memory_bytes"]
+                / max(result["peak_memory_bytes"], 1)))
+    return comparison
+
+
+@click.command()
+@click.option("--max-size", default=SIZES[-1], type=int,
+              help="Largest number of people in a benchmarked city")
+@click.option("--engine", "engines", multiple=True,
+              type=click.Choice(ENGINES),
+              help="Engine to benchmark besides the default; may be "
+                   "repeated (default: all that sir.py offers)")
+@click.option("--draws", default=None, type=click.Choice(DRAW_MODES),
+              help="Draw mode of the simulations, if sir.py offers any "
+                   "(default: that of run_simulation)")
+@click.option("--max-num-days", default=10, type=int)
+@click.option("--repeat", default=3, type=click.IntRange(min=1),
+              help="Number of timed runs of each case")
+@click.option("--random_seed", default=sir.TEST_SEED, type=int)
+@click.option("--output", default="-", type=click.File("w"),
+              help="Where to write the JSON results (default: stdout)")
+@click.option("--compare", default=None, type=click.File("r"),
+              help="JSON results of an earlier run to compare against")
+def cmd(max_size, engines, draws, max_num_days, repeat, random_seed, output,
+        compare):
+    '''
+    Run the benchmarks and write their results.
+    '''
+    cases = benchmark_cases(max_size, list(engines or ENGINES), draws,
+                            max_num_days)
+    results = []
+    for i, case in enumerate(cases):
+        print("[{}/{}] {}".format(i + 1, len(cases), case_key(case)),
+              file=sys.stderr)
+        results.append(benchmark_case(case, repeat, random_seed))
+
+    benchmark = {"commit": git_commit(), "python": platform.python_version(),
+                 "numpy": np.__version__, "machine": platform.machine(),
+                 "results": results}
+    json.dump(benchmark, output, indent=2)
+    output.write("\n")
+
+    if compare is not None:
+        for key, speedup, memory_ratio in compare_results(json.load(compare),
+                                                          benchmark):
+            print("{}: {:.2f}x faster, {:.2f}x less memory"
+                  .format(key, speedup, memory_ratio), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    cmd() # pylint: disable=no-value-for-parameter
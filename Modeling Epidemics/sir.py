@@ -6,25 +6,1247 @@ YOUR NAME
 Functions for running a simple epidemiological simulation
 '''
 
+import csv
+import json
+import mmap
+import multiprocessing
+import os
 import random
+import sys
+import time
+from collections import defaultdict, deque, namedtuple
+from functools import lru_cache
+from itertools import islice
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
 
 import click
+import numpy as np
 
 # This seed should be used for debugging purposes only!  Do not refer
 # to it in your code.
 TEST_SEED = 20170217
 
+# Integer codes used by the array-backed engine.  A city of N people is
+# held as two arrays of length N: the state code of each person and the
+# number of days each infected person has been infected.
+STATE_S = 0
+STATE_I = 1
+STATE_R = 2
+# Days infected are held as int32 by every reader and engine; a person
+# infected for more than 2**31 - 1 days cannot be represented.
+DAYS_DTYPE = np.int32
+
+# Upper bound on the size of the trials x people matrix advanced at once
+# when running many trials.
+MAX_BATCH_CELLS = 1 << 22
+
+# Most units of work the exact solver will do, counting one per person
+# in each outcome of a day it enumerates and one per pair of counts it
+# combines, before giving up on a city.  Its cost grows exponentially
+# with the number of people exposed at once; this keeps it to about a
+# second, refusals included.
+MAX_EXACT_WORK = 1 << 20
+
+# Largest number of uniforms generated at a time by BlockDraws.
+RANDOM_BLOCK_SIZE = 1 << 16
+
+# Least number of seconds between two checkpoints of a simulation, and
+# how many times longer than the last checkpoint took to save the
+# simulation runs before saving the next one.
+CHECKPOINT_INTERVAL = 60.0
+CHECKPOINT_COST_RATIO = 20
+
+# Number of trials run by the adaptive mode before it first checks the
+# width of its confidence interval, and the most it runs by default.
+MIN_ADAPTIVE_TRIALS = 30
+MAX_ADAPTIVE_TRIALS = 100000
+
+# Number of lines of a batch file sent to a worker process at a time,
+# and how many of those chunks each worker may have waiting.
+BATCH_CHUNK_SIZE = 16
+BATCH_CHUNKS_PER_WORKER = 2
+
+WORD_DTYPE = np.dtype("<u8")
+
+# City files are either text, with people separated by commas exactly as
+# on the command line, or binary: BINARY_CITY_MAGIC followed by one byte
+# per person, 0 for "S", 1 for "R" and 2 + x for "Ix".
+BINARY_CITY_MAGIC = b"SIRCITY1"
+MAX_BINARY_DAYS = 253
+# Number of bytes (text) or people (binary) parsed at a time when
+# reading a city file.
+FILE_CHUNK_SIZE = 1 << 18
+
+CITY_ERROR = ("Error: people in the city must be susceptible ('S'),"
+              " recovered ('R'), or infected ('Ix', where *x* is an integer")
+
+
+def city_to_arrays(city):
+    '''
+    Convert a city in list-of-strings form into its array form.
+
+    Inputs:
+      city (list of strings): the state of all people in the city
+
+    Returns tuple (ndarray of uint8, ndarray of int32): the state code
+      of each person and the number of days each infected person has
+      been infected (zero for everyone else).
+    '''
+    states = np.empty(len(city), dtype=np.uint8)
+    days = np.zeros(len(city), dtype=DAYS_DTYPE)
+    for position, person in enumerate(city):
+        if person[0] == "I":
+            states[position] = STATE_I
+            days[position] = int(person[1:])
+        elif person[0] == "R":
+            states[position] = STATE_R
+        else:
+            states[position] = STATE_S
+
+    return states, days
+
+
+def arrays_to_city(states, days):
+    '''
+    Convert a city in array form back into its list-of-strings form.
+
+    Inputs:
+      states (ndarray): the state code of each person
+      days (ndarray): the number of days each infected person has been
+        infected
+
+    Returns (list of strings): the state of all people in the city
+    '''
+    city = np.where(states == STATE_S, "S", "R").astype(object)
+    infected = np.flatnonzero(states == STATE_I)
+    city[infected] = ["I" + str(d) for d in days[infected].tolist()]
+
+    return city.tolist()
+
+
+def parse_person(token):
+    '''
+    Parse the text of one person into its state code and days infected.
+
+    Inputs:
+      token (string): "S", "R" or "Ix", where x is an integer
+
+    Returns tuple (int, int): the state code and days infected
+    '''
+    if token == "S":
+        return STATE_S, 0
+    if token == "R":
+        return STATE_R, 0
+    if token[:1] == "I" and token[1:].isdigit():
+        return STATE_I, int(token[1:])
+    raise ValueError(CITY_ERROR)
+
+
+def _read_text_city(data):
+    '''
+    Parse a comma-separated city held in a memory-mapped file, a chunk
+    at a time, straight into its arrays.
+    '''
+    num_commas = 0
+    for start in range(0, len(data), FILE_CHUNK_SIZE):
+        num_commas += data[start:start + FILE_CHUNK_SIZE].count(b",")
+    states = np.empty(num_commas + 1, dtype=np.uint8)
+    days = np.zeros(num_commas + 1, dtype=DAYS_DTYPE)
+
+    people = {}
+    num_people = 0
+    leftover = b""
+    for start in range(0, len(data), FILE_CHUNK_SIZE):
+        tokens = (leftover + data[start:start + FILE_CHUNK_SIZE]).split(b",")
+        leftover = tokens.pop()
+        parsed = []
+        for token in tokens:
+            if token not in people:
+                people[token] = parse_person(token.strip().decode())
+            parsed.append(people[token])
+        if parsed:
+            chunk = np.array(parsed, dtype=np.int64)
+            states[num_people:num_people + len(parsed)] = chunk[:, 0]
+            days[num_people:num_people + len(parsed)] = chunk[:, 1]
+            num_people += len(parsed)
+    # A trailing comma or newline at the end of the file is allowed.
+    if leftover.strip() or num_people == 0:
+        states[num_people], days[num_people] = \
+            parse_person(leftover.strip().decode())
+        num_people += 1
+
+    return states[:num_people], days[:num_people]
+
+
+def _read_binary_city(data):
+    '''
+    Decode a binary city held in a memory-mapped file, a chunk at a
+    time, straight into its arrays.
+    '''
+    codes = np.frombuffer(data, dtype=np.uint8, offset=len(BINARY_CITY_MAGIC))
+    states = np.empty(len(codes), dtype=np.uint8)
+    days = np.zeros(len(codes), dtype=DAYS_DTYPE)
+    for start in range(0, len(codes), FILE_CHUNK_SIZE):
+        chunk = codes[start:start + FILE_CHUNK_SIZE]
+        states[start:start + len(chunk)] = np.choose(
+            np.minimum(chunk, 2), [STATE_S, STATE_R, STATE_I])
+        days[start:start + len(chunk)] = np.maximum(chunk, 2) - 2
+
+    return states, days
+
+
+def read_city_file(filename):
+    '''
+    Read a city from a text or binary city file, which is memory-mapped
+    and parsed in chunks so that large cities never exist as a list of
+    strings.
+
+    Inputs:
+      filename (string): the name of the city file
+
+    Returns tuple (ndarray, ndarray): the state code and days infected
+      of each person
+    '''
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(CITY_ERROR)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(BINARY_CITY_MAGIC)] == BINARY_CITY_MAGIC:
+                return _read_binary_city(data)
+            return _read_text_city(data)
+
+
+def write_city_file(filename, states, days):
+    '''
+    Write a city in array form to a binary city file.
+
+    Inputs:
+      filename (string): the name of the city file
+      states (ndarray): the state code of each person
+      days (ndarray): the number of days each infected person has been
+        infected
+    '''
+    infected = states == STATE_I
+    if infected.any() and days[infected].max() > MAX_BINARY_DAYS:
+        raise ValueError("Binary city files hold at most {} days infected"
+                         .format(MAX_BINARY_DAYS))
+    codes = np.where(infected, days + 2,
+                     np.where(states == STATE_R, 1, 0)).astype(np.uint8)
+    with open(filename, "wb") as f:
+        f.write(BINARY_CITY_MAGIC)
+        codes.tofile(f)
+
+
+def as_arrays(city):
+    '''
+    Get the array form of a city given as a list of strings, an RLECity,
+    the name of a city file or already in array form.
+
+    Inputs:
+      city (list, RLECity, string or (ndarray, ndarray)): the city
+
+    Returns tuple (ndarray, ndarray): the state code and days infected
+      of each person
+    '''
+    if isinstance(city, (str, os.PathLike)):
+        return read_city_file(city)
+    if isinstance(city, tuple):
+        return city
+    if isinstance(city, RLECity):
+        return city.to_arrays()
+    return city_to_arrays(city)
+
+
+class RLECity:
+    '''
+    A city stored as runs of consecutive people in the same disease
+    state, for long cities made mostly of homogeneous stretches.
+    '''
+
+    def __init__(self, runs):
+        '''
+        Construct a run-length-encoded city.
+
+        Inputs:
+          runs (list of (string, int) pairs): the disease state of each
+            run (e.g. "S", "I0", "R") and the number of people in it
+        '''
+        run_states = np.empty(len(runs), dtype=np.uint8)
+        run_days = np.zeros(len(runs), dtype=DAYS_DTYPE)
+        run_lengths = np.zeros(len(runs), dtype=np.int64)
+        for r, (person, length) in enumerate(runs):
+            run_states[r], run_days[r] = parse_person(person)
+            if length < 0:
+                raise ValueError("Error: the length of a run must be at "
+                                 "least zero")
+            run_lengths[r] = length
+        self._set_runs(run_states, run_days, run_lengths)
+
+    @classmethod
+    def _from_arrays(cls, run_states, run_days, run_lengths):
+        rle_city = cls([])
+        rle_city._set_runs(run_states, run_days, run_lengths)
+        return rle_city
+
+    def _set_runs(self, run_states, run_days, run_lengths):
+        '''
+        Store the runs, dropping empty ones and merging equal neighbors.
+        '''
+        keep = run_lengths > 0
+        run_states = run_states[keep]
+        run_days = run_days[keep]
+        ends = np.cumsum(run_lengths[keep])
+        last = np.ones(len(run_states), dtype=bool)
+        last[:-1] = ((run_states[1:] != run_states[:-1])
+                     | (run_days[1:] != run_days[:-1]))
+        self.run_states = run_states[last]
+        self.run_days = run_days[last]
+        self.run_lengths = np.diff(ends[last], prepend=0)
+        self.starts = ends[last] - self.run_lengths
+        self.num_people = int(ends[-1]) if len(ends) else 0
+
+    @classmethod
+    def from_city(cls, city):
+        '''
+        Encode a city in list-of-strings form.
+
+        Inputs:
+          city (list of strings): the state of all people in the city
+
+        Returns (RLECity): the encoded city
+        '''
+        states, days = city_to_arrays(city)
+        return cls._from_arrays(states, days,
+                                np.ones(len(city), dtype=np.int64))
+
+    @classmethod
+    def from_planes(cls, states, days):
+        '''
+        Encode the result of simulating on the planes of a city.
+
+        Inputs:
+          states (RunPlane): the state code of each person
+          days (RunPlane): the number of days each infected person has
+            been infected
+
+        Returns (RLECity): the encoded city
+        '''
+        base = states.city
+        touched = np.array(sorted(set(states.overrides) | set(days.overrides)),
+                           dtype=np.int64)
+        bounds = np.unique(np.concatenate((base.starts, touched, touched + 1)))
+        bounds = bounds[bounds < base.num_people]
+        return cls._from_arrays(states[bounds], days[bounds],
+                                np.diff(bounds, append=base.num_people))
+
+    def planes(self):
+        '''
+        Get writable views of the state codes and days infected of every
+        person, which only store the people that are written to.
+
+        Returns tuple (RunPlane, RunPlane): the states and days planes
+        '''
+        return RunPlane(self, self.run_states), RunPlane(self, self.run_days)
+
+    def infected_positions(self):
+        '''
+        Returns (ndarray): the sorted positions of the infected people
+        '''
+        runs = np.flatnonzero(self.run_states == STATE_I)
+        return np.concatenate(
+            [np.arange(self.starts[r], self.starts[r] + self.run_lengths[r])
+             for r in runs] + [np.zeros(0, dtype=np.int64)])
+
+    def count_ever_infected(self):
+        '''
+        Returns (int): the number of people infected or recovered
+        '''
+        return int(self.run_lengths[self.run_states != STATE_S].sum())
+
+    def to_arrays(self):
+        '''
+        Returns tuple (ndarray, ndarray): the city in array form
+        '''
+        return (np.repeat(self.run_states, self.run_lengths),
+                np.repeat(self.run_days, self.run_lengths))
+
+    def to_city(self):
+        '''
+        Returns (list of strings): the city in list-of-strings form
+        '''
+        return arrays_to_city(*self.to_arrays())
+
+    def runs(self):
+        '''
+        Returns (list of (string, int) pairs): the state and length of
+          each run
+        '''
+        return list(zip(arrays_to_city(self.run_states, self.run_days),
+                        self.run_lengths.tolist()))
+
+    def __len__(self):
+        return self.num_people
+
+    def __eq__(self, other):
+        return isinstance(other, RLECity) and self.runs() == other.runs()
+
+    def __repr__(self):
+        return "RLECity({})".format(self.runs())
+
+
+class RunPlane:
+    '''
+    One per-person value (state code or days infected) of an RLECity
+    that can be read and written with arrays of positions like an
+    ndarray.  Writes are kept aside in a dictionary, so memory grows
+    with the number of people touched rather than the city length.
+    '''
+
+    def __init__(self, city, run_values):
+        self.city = city
+        self.run_values = run_values
+        self.overrides = {}
+
+    def __len__(self):
+        return self.city.num_people
+
+    def __getitem__(self, positions):
+        runs = np.searchsorted(self.city.starts, positions, side="right") - 1
+        values = self.run_values[runs]
+        if self.overrides:
+            for k, position in enumerate(positions.tolist()):
+                value = self.overrides.get(position)
+                if value is not None:
+                    values[k] = value
+        return values
+
+    def __setitem__(self, positions, values):
+        values = np.broadcast_to(values, positions.shape).tolist()
+        self.overrides.update(zip(positions.tolist(), values))
+
+
+class CompatDraws:
+    '''
+    Draws uniforms with one random() call each, from the random module
+    or a random.Random, so a seeded simulation consumes exactly the
+    sequence that calling advance_person_at_position on every position
+    would.
+    '''
+
+    def __init__(self, rng=random):
+        self.rng = rng
+        self.random = rng.random
+
+    def __call__(self, count):
+        '''
+        Inputs:
+          count (int): the number of uniforms to draw
+
+        Returns (list of floats): the next count uniforms
+        '''
+        return [self.random() for _ in range(count)]
+
+    def getstate(self):
+        '''
+        Returns (dict): the state of the generator, for setstate
+        '''
+        return {"random": self.rng.getstate()}
+
+    def setstate(self, state):
+        '''
+        Restore the state of the generator.
+
+        Inputs:
+          state (dict): a state from getstate, possibly with its tuples
+            turned into lists
+        '''
+        version, internal, gauss_next = state["random"]
+        self.rng.setstate((version, tuple(internal), gauss_next))
+
+
+class BlockDraws:
+    '''
+    Draws uniforms from a seeded NumPy generator, generated ahead in
+    blocks and handed out as slices, so there is no Python call per
+    draw.  The blocks start as large as the first draw and double up to
+    RANDOM_BLOCK_SIZE, so a generator that only draws a few uniforms,
+    like one trial of a small city, only generates a few.  Seeded runs
+    are reproducible, but the draws differ from those of CompatDraws.
+    '''
+
+    def __init__(self, seed, block_size=RANDOM_BLOCK_SIZE):
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.block = np.zeros(0)
+        self.next = 0
+
+    def __call__(self, count):
+        '''
+        Inputs:
+          count (int): the number of uniforms to draw
+
+        Returns (ndarray of floats): the next count uniforms
+        '''
+        if self.next + count > len(self.block):
+            rest = self.block[self.next:]
+            size = min(self.block_size, 2 * len(self.block))
+            self.block = np.concatenate((rest, self.rng.random(
+                max(size, count - len(rest)))))
+            self.next = 0
+        draws = self.block[self.next:self.next + count]
+        self.next = self.next + count
+        return draws
+
+    def getstate(self):
+        '''
+        Returns (dict): the state of the generator, for setstate,
+          including the uniforms generated but not yet drawn
+        '''
+        return {"bit_generator": self.rng.bit_generator.state,
+                "block": self.block[self.next:].copy()}
+
+    def setstate(self, state):
+        '''
+        Restore the state of the generator.
+
+        Inputs:
+          state (dict): a state from getstate
+        '''
+        self.rng.bit_generator.state = state["bit_generator"]
+        self.block = np.asarray(state["block"], dtype=float)
+        self.next = 0
+
+
+# How the random draws of a simulation are made: "compat" reproduces the
+# draws of random.seed(random_seed) exactly, "block" is faster.
+DRAW_MODES = ("compat", "block")
+
+
+def make_draws(random_seed, draws="compat"):
+    '''
+    Seed the random draws of a simulation.
+
+    Inputs:
+      random_seed (int): the random seed to use for the simulation
+      draws (string): one of DRAW_MODES.  "compat" seeds and draws from
+        the random module.
+
+    Returns (CompatDraws or BlockDraws): the draw function
+    '''
+    assert draws in DRAW_MODES
+
+    if draws == "block":
+        return BlockDraws(random_seed)
+    random.seed(random_seed)
+    return CompatDraws()
+
+
+def exposed_positions(states):
+    '''
+    Find every susceptible person with an infected neighbor.
+
+    Inputs:
+      states (ndarray): the state code of each person.  A 2-D array is
+        treated as one independent city per row.
+
+    Returns (ndarray of bool): True at the positions of the susceptible
+      people who have an infected neighbor.
+    '''
+    infected = states == STATE_I
+    has_neighbor = np.zeros(states.shape, dtype=bool)
+    has_neighbor[..., 1:] = infected[..., :-1]
+    has_neighbor[..., :-1] |= infected[..., 1:]
+
+    return has_neighbor & (states == STATE_S)
+
+
+class Topology:
+    '''
+    Who is in contact with whom in a city: the neighbors of every
+    person, held as a compressed sparse row (CSR) adjacency structure.
+    The neighbors of person i are indices[indptr[i]:indptr[i + 1]].
+
+    Without a topology a city is a line, where each person's neighbors
+    are the people to their left and right; Topology.line gives the same
+    result.
+    '''
+
+    def __init__(self, indptr, indices):
+        '''
+        Inputs:
+          indptr (ndarray of ints): num_people + 1 offsets into indices
+          indices (ndarray of ints): the neighbors of every person, one
+            person after the other
+        '''
+        self.indptr = indptr
+        self.indices = indices
+        self.num_people = len(indptr) - 1
+
+    @classmethod
+    def from_edges(cls, num_people, edges):
+        '''
+        Build the topology of a contact network.
+
+        Inputs:
+          num_people (int): the number of people in the city
+          edges (ndarray of ints): one (person, person) row per contact.
+            Contacts go both ways.
+
+        Returns (Topology): the topology
+        '''
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if len(edges) and (edges.min() < 0 or edges.max() >= num_people):
+            raise ValueError("Error: contacts must be between people in "
+                             "the city")
+        sources = np.concatenate((edges[:, 0], edges[:, 1]))
+        targets = np.concatenate((edges[:, 1], edges[:, 0]))
+        order = np.lexsort((targets, sources))
+        index_dtype = np.int32 if num_people < 2 ** 31 else np.int64
+        indptr = np.zeros(num_people + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_people),
+                  out=indptr[1:])
+        return cls(indptr, targets[order].astype(index_dtype))
+
+    @classmethod
+    def line(cls, num_people):
+        '''
+        Returns (Topology): the topology of people standing in a line
+        '''
+        positions = np.arange(max(num_people - 1, 0))
+        return cls.from_edges(num_people,
+                              np.column_stack((positions, positions + 1)))
+
+    @classmethod
+    def grid(cls, num_rows, num_cols):
+        '''
+        Build the topology of people on a grid, each in contact with the
+        people above, below, left and right of them.  Person
+        row * num_cols + col stands at (row, col).
+
+        Inputs:
+          num_rows (int): the number of rows
+          num_cols (int): the number of columns
+
+        Returns (Topology): the topology
+        '''
+        positions = np.arange(num_rows * num_cols).reshape(num_rows,
+                                                           num_cols)
+        across = np.column_stack((positions[:, :-1].ravel(),
+                                  positions[:, 1:].ravel()))
+        down = np.column_stack((positions[:-1].ravel(),
+                                positions[1:].ravel()))
+        return cls.from_edges(num_rows * num_cols,
+                              np.concatenate((across, down)))
+
+    @classmethod
+    def read_edges(cls, filename, num_people):
+        '''
+        Read the topology of a contact network from a file of edges:
+        either a NumPy .npy file holding an array with two columns,
+        which is memory-mapped, or a text file with two people per line.
+
+        Inputs:
+          filename (string): the name of the file
+          num_people (int): the number of people in the city
+
+        Returns (Topology): the topology
+        '''
+        if str(filename).endswith(".npy"):
+            edges = np.load(filename, mmap_mode="r")
+        else:
+            edges = np.loadtxt(filename, dtype=np.int64, ndmin=2)
+        return cls.from_edges(num_people, edges)
+
+    @property
+    def num_edges(self):
+        '''
+        Returns (int): the number of contacts, each counted both ways
+        '''
+        return len(self.indices)
+
+    def neighbors(self, positions):
+        '''
+        Gather the neighbors of some people.
+
+        Inputs:
+          positions (ndarray of ints): the people
+
+        Returns tuple (ndarray, ndarray): for every neighbor found, the
+          index in positions of the person it neighbors, and its
+          position.
+        '''
+        starts = self.indptr[positions]
+        counts = self.indptr[positions + 1] - starts
+        owners = np.repeat(np.arange(len(positions)), counts)
+        ends = np.cumsum(counts)
+        offsets = np.arange(len(owners)) - np.repeat(ends - counts, counts)
+        return owners, self.indices[np.repeat(starts, counts) + offsets]
+
+    def exposed_positions(self, states):
+        '''
+        Find every susceptible person with an infected neighbor, like
+        the function exposed_positions, with a cost that grows with the
+        contacts of the infected people.
+
+        Inputs:
+          states (ndarray): the state code of each person.  A 2-D array
+            is treated as one independent city per row.
+
+        Returns (ndarray of bool): True at the positions of the
+          susceptible people who have an infected neighbor.
+        '''
+        assert states.shape[-1] == self.num_people
+
+        infected = np.nonzero(states == STATE_I)
+        owners, neighbors = self.neighbors(infected[-1])
+        has_neighbor = np.zeros(states.shape, dtype=bool)
+        has_neighbor[tuple(axis[owners] for axis in infected[:-1])
+                     + (neighbors,)] = True
+
+        return has_neighbor & (states == STATE_S)
+
+
+def advance_arrays(states, days, infection_rate, days_contagious,
+                   draw=None, uniforms=None, topology=None):
+    '''
+    Move a city in array form forward a single day.
+
+    The random draws are made in increasing order of position, one per
+    exposed susceptible person, which is exactly the sequence consumed
+    by calling advance_person_at_position on every position in turn.
+
+    Inputs:
+      states (ndarray): the state code of each person at the start of
+        the day
+      days (ndarray): the number of days each infected person has been
+        infected at the start of the day
+      infection_rate (float or ndarray): the chance of getting infected
+        given an infected neighbor, or one per row for 2-D arrays
+      days_contagious (int or ndarray): the number of a days a person is
+        infected, or one per row for 2-D arrays
+      draw (CompatDraws or BlockDraws): the draw function, or for 2-D
+        arrays a list of one per row.  Defaults to drawing from the
+        random module.
+      uniforms (ndarray): if given, the draw of each person, shared by
+        every row, instead of calling draw
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
+
+    Returns tuple (ndarray, ndarray, int, int): the states and days of
+      the city after one day, the number of people newly infected and
+      the number of people who recovered.
+    '''
+    if topology is None:
+        exposed = np.nonzero(exposed_positions(states))
+    else:
+        exposed = np.nonzero(topology.exposed_positions(states))
+    if uniforms is not None:
+        draws = uniforms[exposed[-1]]
+    elif isinstance(draw, list):
+        counts = np.bincount(exposed[0], minlength=len(draw)).tolist()
+        draws = np.concatenate([row_draw(count)
+                                for row_draw, count in zip(draw, counts)]
+                               + [np.zeros(0)])
+    else:
+        draws = (draw or CompatDraws())(len(exposed[0]))
+    rates = np.asarray(infection_rate)
+    if rates.ndim:
+        rates = rates[exposed[0]]
+    hits = np.asarray(draws) < rates
+    newly_infected = tuple(axis[hits] for axis in exposed)
+
+    contagious = np.asarray(days_contagious)
+    if contagious.ndim:
+        contagious = contagious[:, np.newaxis]
+    infected = states == STATE_I
+    new_days = np.where(infected, days + 1, 0)
+    recovering = infected & (new_days >= contagious)
+    new_states = states.copy()
+    new_states[recovering] = STATE_R
+    new_days[new_states != STATE_I] = 0
+    new_states[newly_infected] = STATE_I
+
+    return (new_states, new_days, len(newly_infected[0]),
+            int(np.count_nonzero(recovering)))
+
+
+def advance_frontier(states, days, infected, infection_rate,
+                     days_contagious, draw=None, topology=None):
+    '''
+    Move a city in array form forward a single day, touching only the
+    infected people and their neighbors.  The random draws are made in
+    the same order as advance_arrays.
+
+    Inputs:
+      states (ndarray or RunPlane): the state code of each person,
+        updated in place
+      days (ndarray or RunPlane): the number of days each infected
+        person has been infected, updated in place
+      infected (ndarray): the sorted positions of the infected people
+        at the start of the day
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      draw (CompatDraws or BlockDraws): the draw function.  Defaults to
+        drawing from the random module.
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
+
+    Returns tuple (ndarray, int, int): the sorted positions of the
+      infected people after one day, the number of people newly
+      infected and the number of people who recovered.
+    '''
+    if topology is None:
+        neighbors = np.concatenate((infected - 1, infected + 1))
+        neighbors = neighbors[(neighbors >= 0) & (neighbors < len(states))]
+    else:
+        _, neighbors = topology.neighbors(infected)
+    neighbors = np.unique(neighbors)
+    exposed = neighbors[states[neighbors] == STATE_S]
+    draws = (draw or CompatDraws())(len(exposed))
+    newly_infected = exposed[np.array(draws) < infection_rate]
+
+    infected_days = days[infected] + 1
+    recovering = infected_days >= days_contagious
+    states[infected[recovering]] = STATE_R
+    days[infected[recovering]] = 0
+    still_infected = infected[~recovering]
+    days[still_infected] = infected_days[~recovering]
+    states[newly_infected] = STATE_I
+
+    return (np.union1d(still_infected, newly_infected), len(newly_infected),
+            int(np.count_nonzero(recovering)))
+
+
+def pack_bits(mask):
+    '''
+    Pack a boolean array into 64-bit words, person i being bit i % 64
+    of word i // 64.
+
+    Inputs:
+      mask (ndarray of bool): one flag per person
+
+    Returns (ndarray of uint64): the packed words
+    '''
+    packed = np.packbits(mask, bitorder="little")
+    padded = np.zeros(-(-len(packed) // 8) * 8, dtype=np.uint8)
+    padded[:len(packed)] = packed
+    return padded.view(WORD_DTYPE)
+
+
+def unpack_positions(words):
+    '''
+    Find the positions of the set bits of packed words.
+
+    Inputs:
+      words (ndarray of uint64): the packed words
+
+    Returns (ndarray of ints): the positions of the set bits, in
+      increasing order.  Only the nonzero words are unpacked.
+    '''
+    nonzero = np.flatnonzero(words)
+    bits = np.unpackbits(words[nonzero].view(np.uint8),
+                         bitorder="little").reshape(-1, 64)
+    word_index, bit_index = np.nonzero(bits)
+    return nonzero[word_index] * 64 + bit_index
+
+
+def set_bits(words, positions):
+    '''
+    Set the bits of the given people in packed words, in place.
+
+    Inputs:
+      words (ndarray of uint64): the packed words
+      positions (ndarray of ints): the people whose bits are set
+    '''
+    np.bitwise_or.at(words, positions >> 6,
+                     np.left_shift(np.uint64(1),
+                                   (positions & 63).astype(WORD_DTYPE)))
+
+
+def clear_bits(words, positions):
+    '''
+    Clear the bits of the given people in packed words, in place.
+
+    Inputs:
+      words (ndarray of uint64): the packed words
+      positions (ndarray of ints): the people whose bits are cleared
+    '''
+    np.bitwise_and.at(words, positions >> 6,
+                      ~np.left_shift(np.uint64(1),
+                                     (positions & 63).astype(WORD_DTYPE)))
+
+
+def infected_neighbor_bits(infected):
+    '''
+    Compute, for a whole city at once, which people have an infected
+    neighbor.
+
+    Inputs:
+      infected (ndarray of uint64): the packed infected people
+
+    Returns (ndarray of uint64): the packed people with an infected
+      person to their left or to their right.
+    '''
+    one = np.uint64(1)
+    top = np.uint64(63)
+    from_left = infected << one
+    from_left[1:] |= infected[:-1] >> top
+    from_right = infected >> one
+    from_right[:-1] |= infected[1:] << top
+    return from_left | from_right
+
+
+def advance_bitset(susceptible, infected, stages, recovered, day,
+                   infection_rate, days_contagious, draw=None):
+    '''
+    Move a city held as bit planes forward a single day.  The random
+    draws are made in the same order as advance_arrays.
+
+    Inputs:
+      susceptible (ndarray of uint64): the packed susceptible people,
+        updated in place
+      infected (ndarray of uint64): the packed infected people, updated
+        in place
+      stages (deque of (int, ndarray) pairs): the day each group of
+        infected people was infected on and their positions, oldest
+        first.  Only days on which someone was infected have a stage,
+        so there are never more stages than infected people.  Updated
+        in place.
+      recovered (ndarray of uint64): the packed recovered people,
+        updated in place
+      day (int): the number of days simulated so far
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infectious
+      draw (CompatDraws or BlockDraws): the draw function.  Defaults to
+        drawing from the random module.
+
+    Returns tuple (int, int): the number of people newly infected and
+      the number of people who recovered.
+    '''
+    exposed = unpack_positions(infected_neighbor_bits(infected)
+                               & susceptible)
+    draws = (draw or CompatDraws())(len(exposed))
+    newly_infected = exposed[np.array(draws) < infection_rate]
+
+    newly_recovered = 0
+    while stages and day - stages[0][0] + 1 >= days_contagious:
+        _, positions = stages.popleft()
+        set_bits(recovered, positions)
+        clear_bits(infected, positions)
+        newly_recovered += len(positions)
+    if len(newly_infected):
+        set_bits(infected, newly_infected)
+        clear_bits(susceptible, newly_infected)
+        stages.append((day + 1, newly_infected))
+
+    return len(newly_infected), newly_recovered
+
+
+class DenseEngine:
+    '''
+    Advances every person in the city every day with advance_arrays.
+
+    Every engine is built from the states and days arrays of a city and
+    offers the same interface: step() moves the city forward one day,
+    num_infected is kept up to date as it goes, and arrays() returns
+    the current states and days.  The random draws are made with draw,
+    by default from the random module, and people are in contact as
+    given by topology, by default a line.
+    '''
+
+    def __init__(self, states, days, days_contagious, draw=None,
+                 topology=None):
+        self.states = states
+        self.days = days
+        self.days_contagious = days_contagious
+        self.draw = draw or CompatDraws()
+        self.topology = topology
+        self.num_infected = int(np.count_nonzero(states == STATE_I))
+
+    def step(self, infection_rate):
+        '''
+        Move the city forward a single day.
+
+        Inputs:
+          infection_rate (float): the chance of getting infected given
+            an infected neighbor
+
+        Returns tuple (int, int): the number of people newly infected
+          and the number of people who recovered.
+        '''
+        self.states, self.days, newly_infected, newly_recovered = \
+            advance_arrays(self.states, self.days, infection_rate,
+                           self.days_contagious, self.draw,
+                           topology=self.topology)
+        self.num_infected += newly_infected - newly_recovered
+        return newly_infected, newly_recovered
+
+    def arrays(self):
+        '''
+        Returns tuple (ndarray, ndarray): the current states and days
+        '''
+        return self.states, self.days
+
+
+class FrontierEngine(DenseEngine):
+    '''
+    Advances only the infected people and their neighbors with
+    advance_frontier, so each day costs time proportional to the size
+    of the outbreak rather than the length of the city.
+    '''
+
+    def __init__(self, states, days, days_contagious, infected=None,
+                 draw=None, topology=None):
+        if isinstance(states, np.ndarray):
+            states, days = states.copy(), days.copy()
+        if infected is None:
+            infected = np.flatnonzero(states == STATE_I)
+        super().__init__(states, days, days_contagious, draw, topology)
+        self.infected = infected
+        self.num_infected = len(infected)
+
+    def step(self, infection_rate):
+        self.infected, newly_infected, newly_recovered = advance_frontier(
+            self.states, self.days, self.infected, infection_rate,
+            self.days_contagious, self.draw, self.topology)
+        self.num_infected = len(self.infected)
+        return newly_infected, newly_recovered
+
+
+class BitsetEngine(DenseEngine):
+    '''
+    Advances the whole city as packed bit planes with advance_bitset.
+    Only cities in a line are supported.
+    '''
+
+    def __init__(self, states, days, days_contagious, draw=None,
+                 topology=None):
+        if topology is not None:
+            raise ValueError("Error: the bitset engine only simulates "
+                             "cities in a line")
+        super().__init__(states, days, days_contagious, draw)
+        infected = states == STATE_I
+        self.susceptible = pack_bits(states == STATE_S)
+        self.infected = pack_bits(infected)
+        self.recovered = pack_bits(states == STATE_R)
+        # A person infected for x days was infected on day -x.
+        positions = np.flatnonzero(infected)
+        order = np.argsort(-days[positions], kind="stable")
+        positions, infected_on = positions[order], -days[positions][order]
+        bounds = np.flatnonzero(np.diff(infected_on)) + 1
+        self.stages = deque(
+            (int(group_on[0]), group)
+            for group_on, group in zip(np.split(infected_on, bounds),
+                                       np.split(positions, bounds))
+            if len(group))
+        self.num_steps = 0
+
+    def step(self, infection_rate):
+        newly_infected, newly_recovered = advance_bitset(
+            self.susceptible, self.infected, self.stages, self.recovered,
+            self.num_steps, infection_rate, self.days_contagious, self.draw)
+        self.num_infected += newly_infected - newly_recovered
+        self.num_steps = self.num_steps + 1
+        return newly_infected, newly_recovered
+
+    def arrays(self):
+        states = np.full(len(self.states), STATE_R, dtype=np.uint8)
+        days = np.zeros(len(self.states), dtype=DAYS_DTYPE)
+        states[unpack_positions(self.susceptible)] = STATE_S
+        for infected_on, positions in self.stages:
+            states[positions] = STATE_I
+            days[positions] = self.num_steps - infected_on
+        return states, days
+
+
+# Stepping engines understood by run_simulation.  "frontier" only touches
+# the infected people and their neighbors, so it is much faster when a
+# small part of a long city is infected.  "bitset" packs the city into
+# 64-bit words and finds exposed people with shifts and ORs, so it only
+# takes cities in a line.  All of them give the same result.
+ENGINES = {
+    "dense": DenseEngine,
+    "frontier": FrontierEngine,
+    "bitset": BitsetEngine,
+}
+
+DayCounts = namedtuple(
+    "DayCounts", ["day", "newly_infected", "newly_recovered", "num_infected"])
+
+SIRCounts = namedtuple(
+    "SIRCounts", ["day", "susceptible", "infected", "recovered"])
+
+
+def iter_engine(engine, max_num_days, infection_rate, start_day=0):
+    '''
+    Advance an engine for up to the specified maximum number of days,
+    yielding the counts of each day as it is simulated.
+
+    A day is only ever unchanged when no one is infected, so the
+    simulation stops as soon as the engine's infected count reaches
+    zero.  As before, that final unchanged day counts as simulated.
+
+    Inputs:
+      engine (DenseEngine): the engine holding the city
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      start_day (int): the number of days already simulated, when
+        continuing a simulation
+
+    Yields (DayCounts): the day number, the number of people newly
+      infected and newly recovered that day, and the number of people
+      infected at the end of it.
+    '''
+    s_counter = start_day
+    while s_counter < max_num_days:
+        s_counter = s_counter + 1
+        if engine.num_infected == 0:
+            yield DayCounts(s_counter, 0, 0, 0)
+            return
+        newly_infected, newly_recovered = engine.step(infection_rate)
+        yield DayCounts(s_counter, newly_infected, newly_recovered,
+                        engine.num_infected)
+
+
+def run_engine(engine, max_num_days, infection_rate, day_counts=None,
+               start_day=0, checkpointer=None):
+    '''
+    Advance an engine for up to the specified maximum number of days.
+
+    Inputs:
+      engine (DenseEngine): the engine holding the city
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      day_counts (list): if given, a DayCounts is appended to it for
+        every day simulated
+      start_day (int): the number of days already simulated, when
+        continuing a simulation
+      checkpointer (Checkpointer): if given, told about every day
+        simulated so that it can save the simulation
+
+    Returns (int): the number of days actually simulated
+    '''
+    s_counter = start_day
+    for counts in iter_engine(engine, max_num_days, infection_rate,
+                              start_day):
+        s_counter = counts.day
+        if day_counts is not None:
+            day_counts.append(counts)
+        # The final, unchanged day is not saved, since continuing from it
+        # would simulate another unchanged day.
+        if checkpointer is not None and counts[1:] != (0, 0, 0):
+            checkpointer.day_done(engine, s_counter)
+
+    return s_counter
+
+
+def run_arrays(states, days, max_num_days, infection_rate, days_contagious,
+               engine="dense", day_counts=None, draw=None, start_day=0,
+               checkpointer=None, topology=None):
+    '''
+    Run a simulation on a city in array form for up to the specified
+    maximum number of days.
+
+    Inputs:
+      states (ndarray): the state code of each person at the start of
+        the simulation
+      days (ndarray): the number of days each infected person has been
+        infected at the start of the simulation
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      engine (string): the stepping engine, one of ENGINES
+      day_counts (list): if given, a DayCounts is appended to it for
+        every day simulated
+      draw (CompatDraws or BlockDraws): the draw function.  Defaults to
+        drawing from the random module.
+      start_day (int): the number of days already simulated, when
+        continuing a simulation
+      checkpointer (Checkpointer): if given, told about every day
+        simulated
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
+
+    Returns tuple (ndarray, ndarray, int): the final states and days of
+      the city and the number of days actually simulated.
+    '''
+    assert engine in ENGINES
+
+    sim = ENGINES[engine](states, days, days_contagious, draw=draw,
+                          topology=topology)
+    s_counter = run_engine(sim, max_num_days, infection_rate, day_counts,
+                           start_day, checkpointer)
+    states, days = sim.arrays()
+
+    return states, days, s_counter
+
+
+def count_newly_infected_batch(states, days, random_seeds, max_num_days,
+                               infection_rate, days_contagious,
+                               draws="compat", topology=None):
+    '''
+    Run one simulation per random seed, all advanced together as a
+    trials x people matrix, and count the people newly infected in
+    each.
+
+    Every trial draws on its own, seeded with its seed, so trial i gives
+    the same result as run_simulation with random_seeds[i] and draws.
+
+    Inputs:
+      states (ndarray): the state code of each person at the start of
+        the simulation
+      days (ndarray): the number of days each infected person has been
+        infected at the start of the simulation
+      random_seeds (list of ints): the random seed of each trial
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      draws (string): how the random draws are made, one of DRAW_MODES
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
+
+    Returns (ndarray of ints): the number of people newly infected in
+      each trial.
+    '''
+    assert draws in DRAW_MODES
+
+    if draws == "block":
+        rngs = [BlockDraws(seed) for seed in random_seeds]
+    else:
+        rngs = [CompatDraws(random.Random(seed)) for seed in random_seeds]
+    batch_states = np.tile(states, (len(rngs), 1))
+    batch_days = np.tile(days, (len(rngs), 1))
+    num_days = 0
+    while num_days < max_num_days and (batch_states == STATE_I).any():
+        batch_states, batch_days, _, _ = advance_arrays(
+            batch_states, batch_days, infection_rate, days_contagious, rngs,
+            topology=topology)
+        num_days = num_days + 1
+
+    return ((batch_states != STATE_S) & (states == STATE_S)).sum(axis=1)
+
+
 def count_ever_infected(city):
     '''
     Count the number of people infected or recovered
 
     Inputs:
-      city (list of strings): the state of all people in the
+      city (list of strings or RLECity): the state of all people in the
         simulation at the start of the day
     Returns (int): count of the number of people who have been
       infected at some time.
     '''
 
+    if isinstance(city, RLECity):
+        return city.count_ever_infected()
+
     counter = 0 
     for people in city:  
         if people[0] == "I" or people[0]== "R" : 
@@ -33,7 +1255,7 @@ def count_ever_infected(city):
     return counter
 
 
-def has_an_infected_neighbor(city, position):
+def has_an_infected_neighbor(city, position, topology=None):
     '''
     Determine whether a person has an infected neighbor
 
@@ -41,6 +1263,8 @@ def has_an_infected_neighbor(city, position):
       city (list): the state of all people in the simulation at the
         start of the day
       position (int): the position of the person to check
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
 
     Returns:
       True, if the person has an infected neighbor, False otherwise.
@@ -48,6 +1272,10 @@ def has_an_infected_neighbor(city, position):
 
     assert city[position] == "S"
 
+    if topology is not None:
+        _, neighbors = topology.neighbors(np.array([position]))
+        return any(city[n][0] == "I" for n in neighbors.tolist())
+
     number_people = len(city)
     infected_neighbor = False 
     if number_people == 1:
@@ -65,7 +1293,8 @@ def has_an_infected_neighbor(city, position):
     return infected_neighbor == True
 
 
-def gets_infected_at_position(city, position, infection_rate):
+def gets_infected_at_position(city, position, infection_rate,
+                              topology=None):
     '''
     Determine whether the person at the specified position gets
     infected.
@@ -76,6 +1305,8 @@ def gets_infected_at_position(city, position, infection_rate):
       position (int): the position of the person to check
       infection_rate (float): the chance of getting infected given an
         infected neighbor
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
 
 
     Returns (boolean):
@@ -86,7 +1317,7 @@ def gets_infected_at_position(city, position, infection_rate):
     assert city[position] == "S"
 
     gets_infected = False
-    if has_an_infected_neighbor(city, position):
+    if has_an_infected_neighbor(city, position, topology):
         inmune_level = random.random()
         if inmune_level < infection_rate:
             gets_infected = True
@@ -95,7 +1326,8 @@ def gets_infected_at_position(city, position, infection_rate):
 
 
 def advance_person_at_position(city, position,
-                               infection_rate, days_contagious):
+                               infection_rate, days_contagious,
+                               topology=None):
     '''
     Compute the next state for the person at the specified position.
 
@@ -106,13 +1338,16 @@ def advance_person_at_position(city, position,
       infection_rate (float): the chance of getting infected given an
         infected neighbor
       days_contagious (int): the number of a days a person is infected
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
 
     Returns: (string) disease state of the person after one day
     '''
 
     advance_position = "R"
     if city[position][0] == "S":
-        if gets_infected_at_position(city, position, infection_rate):
+        if gets_infected_at_position(city, position, infection_rate,
+                                     topology):
             advance_position = "I0"
         else: 
             advance_position = "S"
@@ -124,7 +1359,8 @@ def advance_person_at_position(city, position,
     return advance_position
 
 
-def simulate_one_day(starting_city, infection_rate, days_contagious):
+def simulate_one_day(starting_city, infection_rate, days_contagious,
+                     topology=None):
     '''
     Move the simulation forward a single day.
 
@@ -134,61 +1370,471 @@ def simulate_one_day(starting_city, infection_rate, days_contagious):
       infection_rate (float): the chance of getting infected given an
         infected neighbor
       days_contagious (int): the number of a days a person is infected
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
     Returns:
       new_city (list): disease state of the city after one day
     '''
 
-    simulate_one = []
-    for i in range(len(starting_city)): 
-        advance_position = advance_person_at_position(starting_city, i, infection_rate, days_contagious)
-        simulate_one.append(advance_position)
-    
-    return simulate_one
+    states, days = city_to_arrays(starting_city)
+    states, days, _, _ = advance_arrays(states, days, infection_rate,
+                                        days_contagious, topology=topology)
+
+    return arrays_to_city(states, days)
+
+
+def save_checkpoint(filename, sim, draw, s_counter, params):
+    '''
+    Save a running simulation to a checkpoint file, a compressed NumPy
+    archive that replaces the previous checkpoint only once it is
+    completely written.
+
+    Inputs:
+      filename (string): the name of the checkpoint file
+      sim (DenseEngine): the engine holding the city
+      draw (CompatDraws or BlockDraws): the draw function
+      s_counter (int): the number of days simulated
+      params (dict): the infection_rate and days_contagious of the
+        simulation and the form of its starting city ("list", "arrays"
+        or "rle")
+    '''
+    states, days = sim.arrays()
+    arrays = {}
+    if isinstance(states, RunPlane):
+        city = RLECity.from_planes(states, days)
+        states, days = city.run_states, city.run_days
+        arrays["run_lengths"] = city.run_lengths
+
+    rng_state = draw.getstate()
+    for key in [key for key, value in rng_state.items()
+                if isinstance(value, np.ndarray)]:
+        arrays["rng_" + key] = rng_state.pop(key)
+    meta = dict(params, day=s_counter, rng_state=rng_state,
+                draws="block" if isinstance(draw, BlockDraws) else "compat")
+
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, "wb") as f:
+        np.savez_compressed(f, states=states, days=days,
+                            meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(temp_filename, filename)
+
+
+def load_checkpoint(filename):
+    '''
+    Load a simulation saved by save_checkpoint.
+
+    Inputs:
+      filename (string): the name of the checkpoint file
+
+    Returns tuple (list, RLECity or (ndarray, ndarray), int, dict,
+      CompatDraws or BlockDraws): the city in the form of the starting
+      city, the number of days simulated, the parameters of the
+      simulation and the draw function, in the state it was saved in.
+      The random module is restored for "compat" draws.
+    '''
+    with np.load(filename) as data:
+        meta = json.loads(str(data["meta"]))
+        states, days = data["states"], data["days"]
+        if meta["form"] == "rle":
+            city = RLECity._from_arrays(states, days, data["run_lengths"])
+        elif meta["form"] == "list":
+            city = arrays_to_city(states, days)
+        else:
+            city = (states, days)
+        rng_state = meta.pop("rng_state")
+        rng_state.update((key[len("rng_"):], data[key])
+                         for key in data.files if key.startswith("rng_"))
+
+    draw = make_draws(None, meta["draws"])
+    draw.setstate(rng_state)
+    return city, meta.pop("day"), meta, draw
+
+
+class Checkpointer:
+    '''
+    Saves a running simulation to a checkpoint file every interval
+    seconds.  When saving is slow the checkpoints are spread out further,
+    so that at most about 1 / CHECKPOINT_COST_RATIO of the time is spent
+    saving.
+    '''
+
+    def __init__(self, filename, draw, params, interval=CHECKPOINT_INTERVAL):
+        '''
+        Inputs:
+          filename (string): the name of the checkpoint file
+          draw (CompatDraws or BlockDraws): the draw function of the
+            simulation
+          params (dict): the parameters saved with the city (see
+            save_checkpoint)
+          interval (float): the least number of seconds between two
+            checkpoints
+        '''
+        self.filename = filename
+        self.draw = draw
+        self.params = params
+        self.interval = interval
+        self.wait = interval
+        self.last_save = time.monotonic()
+
+    def day_done(self, sim, s_counter):
+        '''
+        Save the simulation if it is time to.
+
+        Inputs:
+          sim (DenseEngine): the engine holding the city
+          s_counter (int): the number of days simulated
+        '''
+        start = time.monotonic()
+        if start - self.last_save < self.wait:
+            return
+        save_checkpoint(self.filename, sim, self.draw, s_counter, self.params)
+        self.last_save = time.monotonic()
+        self.wait = max(self.interval,
+                        (self.last_save - start) * CHECKPOINT_COST_RATIO)
+
+
+def _simulate_city(city, draw, max_num_days, infection_rate,
+                   days_contagious, engine, day_counts, start_day,
+                   checkpoint_file, checkpoint_interval, topology):
+    '''
+    Run or continue a simulation, as described in run_simulation.
+    '''
+    checkpointer = None
+    if checkpoint_file is not None:
+        if isinstance(city, RLECity):
+            form = "rle"
+        elif isinstance(city, (str, os.PathLike, tuple)):
+            form = "arrays"
+        else:
+            form = "list"
+        params = {"infection_rate": infection_rate,
+                  "days_contagious": days_contagious, "form": form}
+        checkpointer = Checkpointer(checkpoint_file, draw, params,
+                                    checkpoint_interval)
+
+    if isinstance(city, RLECity):
+        states, days = city.planes()
+        sim = FrontierEngine(states, days, days_contagious,
+                             city.infected_positions(), draw, topology)
+        s_counter = run_engine(sim, max_num_days, infection_rate,
+                               day_counts, start_day, checkpointer)
+        return (RLECity.from_planes(states, days), s_counter)
+
+    states, days = as_arrays(city)
+    states, days, s_counter = run_arrays(
+        states, days, max_num_days, infection_rate, days_contagious, engine,
+        day_counts, draw, start_day, checkpointer, topology)
+    if isinstance(city, (str, os.PathLike, tuple)):
+        return ((states, days), s_counter)
+
+    return (arrays_to_city(states, days), s_counter)
 
 
 def run_simulation(starting_city, random_seed, max_num_days,
-                   infection_rate, days_contagious):
+                   infection_rate, days_contagious, engine="dense",
+                   day_counts=None, draws="compat", checkpoint_file=None,
+                   checkpoint_interval=CHECKPOINT_INTERVAL, topology=None):
     '''
     Run the entire simulation for up to the specified maximum number
     of days.
 
     Inputs:
-      starting_city (list): the state of all people in the city at the
-        start of the simulation
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation,
+        either as a list, an RLECity, the name of a city file (see
+        read_city_file) or in array form.  An RLECity is always
+        advanced with the frontier engine.
       random_seed (int): the random seed to use for the simulation
       max_num_days (int): the maximum days of the simulation
       infection_rate (float): the chance of getting infected given an
         infected neighbor
       days_contagious (int): the number of a days a person is infected
+      engine (string): the stepping engine, one of ENGINES
+      day_counts (list): if given, a DayCounts with the number of people
+        newly infected, newly recovered and currently infected is
+        appended to it for every day simulated
+      draws (string): how the random draws are made, one of DRAW_MODES.
+        "block" is faster but gives different results than "compat".
+      checkpoint_file (string): if given, the simulation is saved to
+        this file every checkpoint_interval seconds or so, and can be
+        continued from it with resume_simulation
+      checkpoint_interval (float): the least number of seconds between
+        two checkpoints
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
 
-    Returns tuple (list of strings, int): the final state of the city
-      and the number of days actually simulated.
+    Returns tuple (list of strings, RLECity or (ndarray, ndarray), int):
+      the final state of the city, in the same form as starting_city
+      (array form for a city file), and the number of days actually
+      simulated.
     '''
     assert max_num_days >= 0
 
-    random.seed(random_seed)
-    s_counter = 0
-    while s_counter < max_num_days:
-        simulation_temporal = simulate_one_day(starting_city, infection_rate, days_contagious)
-        s_counter = s_counter + 1
-        if simulation_temporal != starting_city:
-            starting_city = simulation_temporal
-        elif simulation_temporal == starting_city:
-            break
+    draw = make_draws(random_seed, draws)
+    return _simulate_city(starting_city, draw, max_num_days, infection_rate,
+                          days_contagious, engine, day_counts, 0,
+                          checkpoint_file, checkpoint_interval, topology)
+
+
+def resume_simulation(checkpoint_file, max_num_days, engine="dense",
+                      day_counts=None,
+                      checkpoint_interval=CHECKPOINT_INTERVAL, topology=None):
+    '''
+    Continue a simulation from the last checkpoint saved by
+    run_simulation, giving exactly the result the simulation would
+    have had if it had not been stopped.  Checkpoints keep being saved
+    to the same file.
+
+    Inputs:
+      checkpoint_file (string): the name of the checkpoint file
+      max_num_days (int): the maximum days of the whole simulation,
+        including the days simulated before the checkpoint
+      engine (string): the stepping engine, one of ENGINES
+      day_counts (list): if given, a DayCounts is appended to it for
+        every day simulated after the checkpoint
+      checkpoint_interval (float): the least number of seconds between
+        two checkpoints
+      topology (Topology): who is in contact with whom, which is not
+        saved in the checkpoint.  Defaults to a line.
 
-    return (simulation_temporal, s_counter)
+    Returns tuple (list of strings, RLECity or (ndarray, ndarray), int):
+      the final state of the city, in the same form as the starting
+      city of the simulation (array form for a city file), and the
+      number of days actually simulated, including those before the
+      checkpoint.
+    '''
+    city, s_counter, params, draw = load_checkpoint(checkpoint_file)
+    return _simulate_city(city, draw, max_num_days, params["infection_rate"],
+                          params["days_contagious"], engine, day_counts,
+                          s_counter, checkpoint_file, checkpoint_interval,
+                          topology)
+
+
+def _shared_array(raw, shape, dtype):
+    '''
+    View a block of shared memory as an array.
+    '''
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _run_segment(shared, bounds, worker, seed, barrier, max_num_days,
+                 infection_rate, days_contagious, draws):
+    '''
+    Advance one segment of a city split across processes by
+    run_simulation_parallel, waiting for the other segments at the end
+    of every day.
+    '''
+    states, days, infected, summary = [
+        _shared_array(*block) for block in shared]
+    lo, hi = bounds[worker], bounds[worker + 1]
+    # The segment is advanced together with the person on either side
+    # of it, whose state at the start of the day is all it needs from
+    # its neighbors.  Their own next state is left to their segment.
+    start, end = max(lo - 1, 0), min(hi + 1, bounds[-1])
+
+    draw = make_draws(seed, draws)
+    try:
+        current = 0
+        s_counter = 0
+        while s_counter < max_num_days:
+            s_counter = s_counter + 1
+            if infected[current].sum() == 0:
+                break
+            new_states, new_days, _, _ = advance_arrays(
+                states[current, start:end], days[current, start:end],
+                infection_rate, days_contagious, draw)
+            states[1 - current, lo:hi] = new_states[lo - start:hi - start]
+            days[1 - current, lo:hi] = new_days[lo - start:hi - start]
+            infected[1 - current, worker] = np.count_nonzero(
+                new_states[lo - start:hi - start] == STATE_I)
+            current = 1 - current
+            barrier.wait()
+        summary[worker] = s_counter, current
+    except BaseException:
+        # Release the other segments rather than leave them waiting.
+        barrier.abort()
+        raise
+
+
+def run_simulation_parallel(starting_city, random_seed, max_num_days,
+                            infection_rate, days_contagious, workers,
+                            draws="compat"):
+    '''
+    Run the entire simulation like run_simulation, with the city split
+    into one contiguous segment per worker process.
+
+    The city is held in shared memory twice, for the start and the end
+    of the day, and each day every process advances its own segment,
+    reading the person just past either end of it from its neighbors.
+    Each segment draws from its own random stream, derived from
+    random_seed and the segment, so the result is reproducible for a
+    given random_seed and number of workers but differs from
+    run_simulation's.
+
+    Inputs:
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation
+        (see run_simulation)
+      random_seed (int): the random seed to use for the simulation
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      workers (int): the number of processes to split the city over
+      draws (string): how the random draws are made, one of DRAW_MODES
+
+    Returns tuple (list of strings, RLECity or (ndarray, ndarray), int):
+      the final state of the city, in the same form as starting_city
+      (array form for a city file), and the number of days actually
+      simulated.
+    '''
+    assert max_num_days >= 0
+    assert workers > 0
+
+    states, days = as_arrays(starting_city)
+    num_people = len(states)
+    workers = max(1, min(workers, num_people))
+    bounds = [num_people * w // workers for w in range(workers + 1)]
+    seeds = np.random.SeedSequence(random_seed).generate_state(workers)
+
+    ctx = multiprocessing.get_context()
+    shared = []
+    for shape, dtype in [((2, num_people), np.uint8),
+                         ((2, num_people), DAYS_DTYPE),
+                         ((2, workers), np.int64),
+                         ((workers, 2), np.int64)]:
+        raw = ctx.RawArray(np.ctypeslib.as_ctypes_type(dtype),
+                           shape[0] * shape[1])
+        shared.append((raw, shape, dtype))
+    shared_states, shared_days, infected, summary = [
+        _shared_array(*block) for block in shared]
+    shared_states[0] = states
+    shared_days[0] = days
+    infected[0] = [np.count_nonzero(states[lo:hi] == STATE_I)
+                   for lo, hi in zip(bounds, bounds[1:])]
+
+    barrier = ctx.Barrier(workers)
+    processes = [ctx.Process(target=_run_segment,
+                             args=(shared, bounds, worker, int(seed), barrier,
+                                   max_num_days, infection_rate,
+                                   days_contagious, draws))
+                 for worker, seed in enumerate(seeds.tolist())]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError("A worker failed while simulating its segment")
+
+    s_counter, current = summary[0].tolist()
+    states = shared_states[current].copy()
+    days = shared_days[current].copy()
+    if isinstance(starting_city, RLECity):
+        return (RLECity._from_arrays(states, days,
+                                     np.ones(num_people, dtype=np.int64)),
+                s_counter)
+    if isinstance(starting_city, (str, os.PathLike, tuple)):
+        return ((states, days), s_counter)
+
+    return (arrays_to_city(states, days), s_counter)
+
+
+def simulate_series(starting_city, random_seed, max_num_days,
+                    infection_rate, days_contagious, engine="dense",
+                    draws="compat", topology=None):
+    '''
+    Run the entire simulation like run_simulation, yielding the number
+    of susceptible, infected and recovered people at the start and at
+    the end of every simulated day.  The counts are updated from what
+    changed each day, so no intermediate city is ever counted or
+    converted.
+
+    Inputs:
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation
+        (see run_simulation)
+      random_seed (int): the random seed to use for the simulation
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      engine (string): the stepping engine, one of ENGINES
+      draws (string): how the random draws are made, one of DRAW_MODES
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
+
+    Yields (SIRCounts): the counts for day 0 (the starting city) and
+      for each day simulated
+    '''
+    assert max_num_days >= 0
+
+    draw = make_draws(random_seed, draws)
+    if isinstance(starting_city, RLECity):
+        states, days = starting_city.planes()
+        sim = FrontierEngine(states, days, days_contagious,
+                             starting_city.infected_positions(), draw,
+                             topology)
+        susceptible = len(starting_city) - starting_city.count_ever_infected()
+    else:
+        states, days = as_arrays(starting_city)
+        sim = ENGINES[engine](states, days, days_contagious, draw=draw,
+                              topology=topology)
+        susceptible = int(np.count_nonzero(states == STATE_S))
+    infected = sim.num_infected
+    recovered = len(states) - susceptible - infected
+    yield SIRCounts(0, susceptible, infected, recovered)
+
+    for counts in iter_engine(sim, max_num_days, infection_rate):
+        susceptible = susceptible - counts.newly_infected
+        recovered = recovered + counts.newly_recovered
+        yield SIRCounts(counts.day, susceptible, counts.num_infected,
+                        recovered)
+
+
+def write_series_csv(series, f):
+    '''
+    Write daily S/I/R counts to a CSV file one row at a time, as they
+    are produced.
+
+    Inputs:
+      series (iterable of SIRCounts): the daily counts
+      f (file): the file to write to
+    '''
+    writer = csv.writer(f)
+    writer.writerow(SIRCounts._fields)
+    for counts in series:
+        writer.writerow(counts)
+
+
+def trial_seeds(random_seed, num_trials):
+    '''
+    Compute the random seed of each trial: the first trial uses
+    random_seed and each subsequent trial increments it once.
+
+    Inputs:
+      random_seed (int or None): the starting random seed.  None gives
+        every trial an unseeded generator.
+      num_trials (int): the number of trials
+
+    Returns (list): the seed of each trial
+    '''
+    if random_seed is None:
+        return [None] * num_trials
+    return list(range(random_seed, random_seed + num_trials))
 
 
 def calc_avg_num_newly_infected(
         starting_city, random_seed, max_num_days,
-        infection_rate, days_contagious, num_trials):
+        infection_rate, days_contagious, num_trials, workers=1,
+        draws="compat", topology=None):
     '''
     Conduct N trials with the specified infection probability and
     calculate the number of people on average get infected over time.
 
     Inputs:
-      starting_city (list): the state of all people in the city at the
-        start of the simulation
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation
+        (see run_simulation)
       random_seed (int): the starting random seed. Use this value for
         the FIRST simulation, and then increment it once for each
         subsequent run.
@@ -197,70 +1843,698 @@ def calc_avg_num_newly_infected(
         infected neighbor
       days_contagious (int): the number of a days a person is infected
       num_trials (int): the number of trials to run
+      workers (int): the number of processes to spread the trials
+        over.  Every trial is seeded on its own, so the result does not
+        depend on the number of workers.
+      draws (string): how the random draws are made, one of DRAW_MODES
+      topology (Topology): who is in contact with whom.  Defaults to a
+        line.
 
     Returns (float): the average number of people infected over time
     '''
     assert max_num_days >= 0
     assert num_trials > 0
-    counter_x = 0
-    for i in range(0, num_trials):
-        temporal_city = run_simulation(starting_city, random_seed, max_num_days, infection_rate, days_contagious)
-        random_seed = random_seed + 1
-        final_city = temporal_city[0]
-        for x in range(len(starting_city)):
-            if starting_city[x] == "S":
-                if starting_city[x] != final_city[x]:
-                    counter_x = counter_x + 1
-    calc_avg = counter_x / num_trials
-    print(counter_x)
-    
-    return calc_avg
+    assert workers > 0
+
+    states, days = as_arrays(starting_city)
+    seeds = trial_seeds(random_seed, num_trials)
+    batch_size = max(1, MAX_BATCH_CELLS // max(1, len(states)))
+    if workers > 1:
+        batch_size = min(batch_size, -(-num_trials // workers))
+    batches = [seeds[start:start + batch_size]
+               for start in range(0, num_trials, batch_size)]
+    args = (max_num_days, infection_rate, days_contagious, draws, topology)
+
+    if workers == 1:
+        counts = [count_newly_infected_batch(states, days, batch, *args)
+                  for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(
+                count_newly_infected_batch, [states] * len(batches),
+                [days] * len(batches), batches,
+                *[[arg] * len(batches) for arg in args]))
+    counter_x = sum(int(count.sum()) for count in counts)
+
+    return counter_x / num_trials
+
+
+def calc_avg_num_newly_infected_adaptive(
+        starting_city, random_seed, max_num_days, infection_rate,
+        days_contagious, tolerance, max_trials, confidence=0.95,
+        min_trials=MIN_ADAPTIVE_TRIALS, draws="compat"):
+    '''
+    Run trials until the confidence interval on the average number of
+    people newly infected is at most tolerance on either side of the
+    estimate, or max_trials trials have been run.
+
+    Trials are seeded exactly as in calc_avg_num_newly_infected and run
+    in batches that double in size, so the estimate after n trials is
+    the same as calc_avg_num_newly_infected with num_trials=n.
+
+    Inputs:
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation
+        (see run_simulation)
+      random_seed (int): the starting random seed
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+      tolerance (float): the largest acceptable half-width of the
+        confidence interval
+      max_trials (int): the largest number of trials to run
+      confidence (float): the confidence level of the interval
+      min_trials (int): the number of trials to run before checking
+        the interval
+      draws (string): how the random draws are made, one of DRAW_MODES
+
+    Returns tuple (float, float, int): the average number of people
+      newly infected, the half-width of its confidence interval and the
+      number of trials run.
+    '''
+    assert max_num_days >= 0
+    assert tolerance >= 0
+    assert max_trials > 0
+    assert 0 < confidence < 1
+
+    states, days = as_arrays(starting_city)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    max_batch_size = max(1, MAX_BATCH_CELLS // max(1, len(states)))
+    num_trials = 0
+    total = 0
+    total_squares = 0
+    batch_size = min(max(min_trials, 1), max_trials)
+    while True:
+        if random_seed is None:
+            seeds = [None] * batch_size
+        else:
+            seeds = trial_seeds(random_seed + num_trials, batch_size)
+        counts = count_newly_infected_batch(
+            states, days, seeds, max_num_days, infection_rate,
+            days_contagious, draws)
+        num_trials = num_trials + batch_size
+        total = total + int(counts.sum())
+        total_squares = total_squares + int((counts ** 2).sum())
+
+        avg = total / num_trials
+        half_width = float("inf")
+        if num_trials > 1:
+            variance = max(total_squares - total * avg, 0) / (num_trials - 1)
+            half_width = z * (variance / num_trials) ** 0.5
+        if half_width <= tolerance or num_trials >= max_trials:
+            return avg, half_width, num_trials
+        batch_size = min(num_trials, max_batch_size, max_trials - num_trials)
+
+
+def exact_newly_infected_distribution(starting_city, max_num_days,
+                                      infection_rate, days_contagious):
+    '''
+    Compute the exact distribution of the number of people newly
+    infected over a simulation, under the same rules as
+    advance_person_at_position.
+
+    Recovered people never change and block the infection, so every
+    city state is split at them into independent segments, and only
+    segments with someone infected matter.  The distribution of each
+    segment is found by dynamic programming over the states it can
+    reach, memoized on the segment and the number of days left, and the
+    distributions of the segments are then combined.
+
+    Exact fractions can be used by passing a fractions.Fraction as the
+    infection rate.  Cities that would take more than MAX_EXACT_WORK
+    units of work are refused with a ValueError.
+
+    Inputs:
+      starting_city (list): the state of all people in the city at the
+        start of the simulation
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+
+    Returns (dict): the probability of each number of people newly
+      infected
+    '''
+    assert max_num_days >= 0
+
+    # A state holds one int per person: SUSCEPTIBLE, RECOVERED or the
+    # days infected.  People infected for days_contagious - 1 days or
+    # more all recover on the next day, so their days are capped.
+    last_day = max(days_contagious - 1, 0)
+    susceptible, recovered = -1, -2
+    work = [0]
+
+    def spend(amount):
+        work[0] = work[0] + amount
+        if work[0] > MAX_EXACT_WORK:
+            raise ValueError("Error: the city is too large to solve exactly")
+
+    def segments(state):
+        '''
+        Split a state at the recovered people, keeping the segments
+        with someone infected, each with the most days that can still
+        make a difference to it.
+        '''
+        result = []
+        start = 0
+        for end, person in enumerate(list(state) + [recovered]):
+            if person == recovered:
+                segment = tuple(state[start:end])
+                if segment and max(segment) >= 0:
+                    result.append(segment)
+                start = end + 1
+        return result
+
+    def combine(distribution, other):
+        spend(len(distribution) * len(other))
+        combined = defaultdict(int)
+        for count, prob in distribution.items():
+            for other_count, other_prob in other.items():
+                combined[count + other_count] += prob * other_prob
+        return combined
+
+    @lru_cache(maxsize=None)
+    def transitions(segment):
+        exposed = [position for position, person in enumerate(segment)
+                   if person == susceptible
+                   and ((position > 0 and segment[position - 1] >= 0)
+                        or (position + 1 < len(segment)
+                            and segment[position + 1] >= 0))]
+        aged = [recovered if person >= last_day
+                else person + 1 if person >= 0 else person
+                for person in segment]
+        # Every outcome copies the segment and splits it again.
+        spend((1 << len(exposed)) * (len(segment) + 1))
+        result = []
+        for outcome in range(1 << len(exposed)):
+            next_state = list(aged)
+            prob = 1
+            for k, position in enumerate(exposed):
+                if outcome >> k & 1:
+                    next_state[position] = 0
+                    prob = prob * infection_rate
+                else:
+                    prob = prob * (1 - infection_rate)
+            result.append((segments(next_state), bin(outcome).count("1"),
+                           prob))
+        return result
+
+    def horizon(segment):
+        # Every day someone is infected, and nobody can be infected
+        # twice, so a segment settles within this many days.
+        return (len(segment) + 1) * (last_day + 1)
+
+    @lru_cache(maxsize=None)
+    def solve(segment, num_days):
+        if num_days == 0:
+            return {0: 1}
+        distribution = defaultdict(int)
+        spend(len(transitions(segment)))
+        for next_segments, num_infected, prob in transitions(segment):
+            outcome = {num_infected: prob}
+            for next_segment in next_segments:
+                outcome = combine(outcome, solve(
+                    next_segment, min(num_days - 1, horizon(next_segment))))
+            for count, outcome_prob in outcome.items():
+                distribution[count] += outcome_prob
+        return distribution
+
+    state = []
+    for person in starting_city:
+        if person[0] == "I":
+            state.append(min(int(person[1:]), last_day))
+        else:
+            state.append(susceptible if person == "S" else recovered)
+
+    distribution = {0: 1}
+    recursion_limit = sys.getrecursionlimit()
+    try:
+        for segment in segments(state):
+            num_days = min(max_num_days, horizon(segment))
+            sys.setrecursionlimit(max(recursion_limit, 2 * num_days + 100))
+            distribution = combine(distribution, solve(segment, num_days))
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+
+    return dict(sorted(distribution.items()))
+
+
+def exact_avg_num_newly_infected(starting_city, max_num_days,
+                                 infection_rate, days_contagious):
+    '''
+    Compute the exact expected number of people newly infected, the
+    value calc_avg_num_newly_infected estimates by Monte Carlo.
+
+    Inputs:
+      starting_city (list): the state of all people in the city at the
+        start of the simulation
+      max_num_days (int): the maximum days of the simulation
+      infection_rate (float): the chance of getting infected given an
+        infected neighbor
+      days_contagious (int): the number of a days a person is infected
+
+    Returns (float): the expected number of people newly infected
+    '''
+    distribution = exact_newly_infected_distribution(
+        starting_city, max_num_days, infection_rate, days_contagious)
+    return sum(count * prob for count, prob in distribution.items())
+
+
+def sweep_avg_num_newly_infected(
+        starting_city, random_seed, max_num_days,
+        infection_rates, days_contagious_values, num_trials):
+    '''
+    Calculate the average number of people newly infected for every
+    combination of infection rate and days contagious in one pass.
+
+    Each trial uses common random numbers: a single uniform draw per
+    person per day, from a generator seeded with random_seed + i, is
+    shared by every grid point, so all grid points of a trial are
+    advanced together as the rows of one matrix.  Because the draws are
+    made differently, the averages differ from (but are distributed
+    like) those of calc_avg_num_newly_infected, and differences between
+    grid points are much less noisy.
+
+    Inputs:
+      starting_city (list, RLECity, string or (ndarray, ndarray)): the
+        state of all people in the city at the start of the simulation
+        (see run_simulation)
+      random_seed (int): the starting random seed
+      max_num_days (int): the maximum days of the simulation
+      infection_rates (list of floats): the infection rates to try
+      days_contagious_values (list of ints): the days contagious to try
+      num_trials (int): the number of trials to run
+
+    Returns (list of (float, int, float) tuples): the infection rate,
+      days contagious and average number of people newly infected for
+      each grid point.
+    '''
+    assert max_num_days >= 0
+    assert num_trials > 0
+
+    states, days = as_arrays(starting_city)
+    grid = [(rate, contagious) for rate in infection_rates
+            for contagious in days_contagious_values]
+    rates = np.array([rate for rate, _ in grid])
+    contagious = np.array([contagious for _, contagious in grid])
+    totals = np.zeros(len(grid), dtype=np.int64)
+
+    for seed in trial_seeds(random_seed, num_trials):
+        rng = np.random.default_rng(seed)
+        grid_states = np.tile(states, (len(grid), 1))
+        grid_days = np.tile(days, (len(grid), 1))
+        num_days = 0
+        while num_days < max_num_days and (grid_states == STATE_I).any():
+            grid_states, grid_days, _, _ = advance_arrays(
+                grid_states, grid_days, rates, contagious,
+                uniforms=rng.random(len(states)))
+            num_days = num_days + 1
+        totals += ((grid_states != STATE_S) & (states == STATE_S)).sum(axis=1)
+
+    return [(rate, days_contagious, total / num_trials)
+            for (rate, days_contagious), total in zip(grid, totals.tolist())]
+
+
+def write_sweep_csv(sweep, f):
+    '''
+    Write the result of a parameter sweep to a CSV file.
+
+    Inputs:
+      sweep (list of (float, int, float) tuples): the result of
+        sweep_avg_num_newly_infected
+      f (file): the file to write to
+    '''
+    writer = csv.writer(f)
+    writer.writerow(["infection_rate", "days_contagious",
+                     "avg_num_newly_infected"])
+    writer.writerows(sweep)
+
+
+def parse_values(text, value_type):
+    '''
+    Parse a comma-separated list of numbers given on the command line.
+
+    Inputs:
+      text (string): the comma-separated values
+      value_type (type): int or float
+
+    Returns (list): the values
+    '''
+    return [value_type(value) for value in text.split(",")]
+
+
+# Parameters a line of a batch file may set, with the tasks it may run.
+BATCH_PARAMETERS = ("random_seed", "max_num_days", "infection_rate",
+                    "days_contagious", "num_trials", "engine", "draws",
+                    "task_type")
+BATCH_TASK_TYPES = ("single", "average", "exact")
+
+
+def run_batch_line(line, defaults):
+    '''
+    Evaluate one line of a batch file.
+
+    Inputs:
+      line (string): a JSON object with the city, either a
+        comma-separated string or a list of strings, under "city", any
+        of BATCH_PARAMETERS and optionally an "id" that is copied to the
+        result
+      defaults (dict): the value of every parameter in BATCH_PARAMETERS
+        that the line leaves out
+
+    Returns (dict): the result, with "days_simulated" and "final_city"
+      for a single simulation, "avg_num_newly_infected" for the other
+      tasks, or "error" if the line could not be evaluated.
+    '''
+    result = {}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError("Error: each line must be a JSON object")
+        if "id" in request:
+            result["id"] = request["id"]
+        unknown = set(request) - set(BATCH_PARAMETERS) - {"city", "id"}
+        if unknown:
+            raise ValueError("Error: unknown parameter(s) "
+                             + ", ".join(sorted(unknown)))
+        params = dict(defaults)
+        params.update((key, request[key]) for key in BATCH_PARAMETERS
+                      if key in request)
+        if params["task_type"] not in BATCH_TASK_TYPES:
+            raise ValueError("Error: task_type must be one of "
+                             + ", ".join(BATCH_TASK_TYPES))
+        if params["engine"] not in list(ENGINES):
+            raise ValueError("Error: engine must be one of "
+                             + ", ".join(ENGINES))
+        if params["draws"] not in DRAW_MODES:
+            raise ValueError("Error: draws must be one of "
+                             + ", ".join(DRAW_MODES))
+
+        city = request.get("city")
+        if isinstance(city, str):
+            city = [p.strip() for p in city.split(",")]
+        if not isinstance(city, list):
+            raise ValueError("Error: each line needs a city")
+        for p in city:
+            parse_person(p)
+
+        args = (params["max_num_days"], params["infection_rate"],
+                params["days_contagious"])
+        if params["task_type"] == "single":
+            final_city, num_days_simulated = run_simulation(
+                city, params["random_seed"], *args, params["engine"],
+                draws=params["draws"])
+            result["days_simulated"] = num_days_simulated
+            result["final_city"] = final_city
+        elif params["task_type"] == "exact":
+            result["avg_num_newly_infected"] = exact_avg_num_newly_infected(
+                city, *args)
+        else:
+            result["avg_num_newly_infected"] = calc_avg_num_newly_infected(
+                city, params["random_seed"], *args, params["num_trials"],
+                draws=params["draws"])
+    except (ValueError, TypeError, KeyError, AssertionError) as e:
+        result["error"] = str(e)
+
+    return result
+
+
+def run_batch(lines, defaults, workers=1):
+    '''
+    Evaluate every line of a batch file in this process, or spread over
+    a pool of processes, yielding the results in the order of the
+    lines.
+
+    Inputs:
+      lines (iterable of strings): the lines of the batch file.  Blank
+        lines are skipped.
+      defaults (dict): the parameters used where a line leaves them out
+        (see run_batch_line)
+      workers (int): the number of processes to use
+
+    Yields (dict): the result of each line
+    '''
+    assert workers > 0
+
+    lines = (line for line in lines if line.strip())
+    if workers == 1:
+        for line in lines:
+            yield run_batch_line(line, defaults)
+        return
+
+    # Only a few chunks per worker are read ahead of the results
+    # yielded, so a long batch file is never held in memory at once.
+    chunks = iter(lambda: list(islice(lines, BATCH_CHUNK_SIZE)), [])
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunks:
+            pending.append(pool.submit(_run_batch_chunk, chunk, defaults))
+            if len(pending) >= BATCH_CHUNKS_PER_WORKER * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _run_batch_chunk(lines, defaults):
+    '''
+    Evaluate a chunk of lines of a batch file in a worker process.
+    '''
+    return [run_batch_line(line, defaults) for line in lines]
+
+
+def write_batch_jsonl(results, f):
+    '''
+    Write the results of a batch one JSON line at a time, as they are
+    produced.
+
+    Inputs:
+      results (iterable of dicts): the results
+      f (file): the file to write to
+    '''
+    for result in results:
+        f.write(json.dumps(result) + "\n")
+        f.flush()
 
 
 ################ Do not change the code below this line #######################
 
 
 @click.command()
-@click.argument("city", type=str)
+@click.argument("city", type=str, required=False)
+@click.option("--city-file", default=None, type=click.Path(exists=True),
+              help="Read the city from a text or binary city file")
+@click.option("--batch-file", default=None, type=click.File("r"),
+              help="Evaluate every city of a JSON-lines file, writing one "
+                   "JSON result per line to --output; the other options "
+                   "are the defaults for each line")
 @click.option("--random_seed", default=None, type=int)
 @click.option("--max-num-days", default=1, type=int)
 @click.option("--infection-rate", default=0.5, type=float)
 @click.option("--days-contagious", default=2, type=int)
 @click.option("--num-trials", default=1, type=int)
+@click.option("--workers", default=1, type=click.IntRange(min=1),
+              help="Number of processes used to run the trials")
+@click.option("--segments", default=1, type=click.IntRange(min=1),
+              help="Split the city of a single simulation into this many "
+                   "segments, each advanced by its own process; the result "
+                   "depends on the number of segments")
+@click.option("--engine", default=None,
+              type=click.Choice(list(ENGINES)),
+              help="Stepping engine used for single simulations "
+                   "(default: dense)")
+@click.option("--draws", default="compat", type=click.Choice(DRAW_MODES),
+              help="How random draws are made: 'compat' reproduces the "
+                   "random module's sequence, 'block' is faster")
+@click.option("--grid-width", default=None, type=click.IntRange(min=1),
+              help="Put the people of the city on a grid this many people "
+                   "wide instead of in a line")
+@click.option("--edges-file", default=None, type=click.Path(exists=True),
+              help="Put the people of the city in contact as given by a "
+                   ".npy or text file of pairs of people")
 @click.option("--task-type", default="single",
-              type=click.Choice(['single', 'average']))
-def cmd(city, random_seed, max_num_days, infection_rate,
-        days_contagious, num_trials, task_type):
+              type=click.Choice(['single', 'average', 'adaptive', 'exact',
+                                 'series', 'sweep']))
+@click.option("--tolerance", default=0.1, type=float,
+              help="Half-width of the confidence interval at which the "
+                   "adaptive task stops")
+@click.option("--confidence", default=0.95, type=float,
+              help="Confidence level used by the adaptive task")
+@click.option("--max-trials", default=MAX_ADAPTIVE_TRIALS,
+              type=click.IntRange(min=1),
+              help="Most trials the adaptive task runs")
+@click.option("--sweep-infection-rates", default=None, type=str,
+              help="Comma-separated infection rates to sweep over")
+@click.option("--sweep-days-contagious", default=None, type=str,
+              help="Comma-separated days contagious to sweep over")
+@click.option("--checkpoint", default=None, type=click.Path(dir_okay=False),
+              help="Save a single simulation to this file every "
+                   "--checkpoint-interval seconds or so")
+@click.option("--checkpoint-interval", default=CHECKPOINT_INTERVAL,
+              type=float, help="Least number of seconds between checkpoints")
+@click.option("--resume", is_flag=True,
+              help="Continue the single simulation saved in --checkpoint "
+                   "instead of starting one")
+@click.option("--output", default="-", type=click.File("w"),
+              help="Where to write the CSV of a series or sweep, or the "
+                   "results of a batch (default: stdout)")
+def cmd(city, city_file, batch_file, random_seed, max_num_days, infection_rate,
+        days_contagious, num_trials, workers, segments, engine, draws,
+        grid_width,
+        edges_file, task_type, tolerance, confidence, max_trials,
+        sweep_infection_rates, sweep_days_contagious, checkpoint,
+        checkpoint_interval, resume, output):
     '''
     Process the command-line arguments and do the work.
     '''
 
-    # Convert the city string into a city list.
-    city = [p.strip() for p in city.split(",")]
-    emsg = ("Error: people in the city must be susceptible ('S'),"
-            " recovered ('R'), or infected ('Ix', where *x* is an integer")
-    for p in city:
-        if p[0] == "I":
+    if segments > 1 and (task_type != "single" or batch_file is not None
+                         or engine is not None or checkpoint is not None
+                         or resume or grid_width is not None
+                         or edges_file is not None):
+        print("Error: --segments only applies to a single simulation, "
+              "without --engine, checkpoints, --grid-width or --edges-file")
+        return -1
+    engine = engine or "dense"
+
+    if batch_file is not None:
+        if city is not None or city_file is not None:
+            print("Error: give either a city, --city-file or --batch-file")
+            return -1
+        defaults = {"random_seed": random_seed, "max_num_days": max_num_days,
+                    "infection_rate": infection_rate,
+                    "days_contagious": days_contagious,
+                    "num_trials": num_trials, "engine": engine,
+                    "draws": draws, "task_type": task_type}
+        write_batch_jsonl(run_batch(batch_file, defaults, workers), output)
+        return 0
+
+    topology = None
+    use_topology = grid_width is not None or edges_file is not None
+    if use_topology and (resume or checkpoint is not None
+                         or task_type not in ("single", "series", "average")):
+        print("Error: --grid-width and --edges-file only apply to the "
+              "single, series and average tasks, without checkpoints")
+        return -1
+    if grid_width is not None and edges_file is not None:
+        print("Error: give either --grid-width or --edges-file")
+        return -1
+
+    if resume:
+        if checkpoint is None:
+            print("Error: --resume needs --checkpoint")
+            return -1
+        print("Resuming one simulation...")
+        final_city, num_days_simulated = resume_simulation(
+            checkpoint, max_num_days, engine,
+            checkpoint_interval=checkpoint_interval)
+        if isinstance(final_city, tuple):
+            print("Final city: {} susceptible, {} infected, {} recovered"
+                  .format(*np.bincount(final_city[0], minlength=3)))
+        else:
+            print("Final city:9", final_city)
+        print("Days simulated:", num_days_simulated)
+        return 0
+
+    if (city is None) == (city_file is None):
+        print("Error: give either a city or --city-file")
+        return -1
+
+    if city_file is not None:
+        try:
+            city = read_city_file(city_file)
+        except ValueError as e:
+            print(e)
+            return -1
+    else:
+        # Convert the city string into a city list.
+        city = [p.strip() for p in city.split(",")]
+        for p in city:
             try:
-                _ = int(p[1])
-            except ValueError:
-                print(emsg)
+                parse_person(p)
+            except ValueError as e:
+                print(e)
                 return -1
-        elif p not in {"S", "R"}:
-            print(emsg)
-            return -1
+
+    num_people = len(city[0]) if isinstance(city, tuple) else len(city)
+    try:
+        if grid_width is not None:
+            if num_people % grid_width != 0:
+                raise ValueError("Error: the city does not fill a grid {} "
+                                 "people wide".format(grid_width))
+            topology = Topology.grid(num_people // grid_width, grid_width)
+        elif edges_file is not None:
+            topology = Topology.read_edges(edges_file, num_people)
+        if topology is not None and engine == "bitset":
+            raise ValueError("Error: the bitset engine only simulates "
+                             "cities in a line")
+    except ValueError as e:
+        print(e)
+        return -1
 
     if task_type == "single":
         print("Running one simulation...")
-        final_city, num_days_simulated = run_simulation(
-            city, random_seed, max_num_days, infection_rate, days_contagious)
-        print("Final city:9", final_city)
+        if segments > 1:
+            final_city, num_days_simulated = run_simulation_parallel(
+                city, random_seed, max_num_days, infection_rate,
+                days_contagious, segments, draws)
+        else:
+            final_city, num_days_simulated = run_simulation(
+                city, random_seed, max_num_days, infection_rate,
+                days_contagious, engine, draws=draws,
+                checkpoint_file=checkpoint,
+                checkpoint_interval=checkpoint_interval, topology=topology)
+        if city_file is not None:
+            states = final_city[0]
+            print("Final city: {} susceptible, {} infected, {} recovered"
+                  .format(*np.bincount(states, minlength=3)))
+        else:
+            print("Final city:9", final_city)
         print("Days simulated:", num_days_simulated)
+    elif task_type == "series":
+        write_series_csv(
+            simulate_series(city, random_seed, max_num_days, infection_rate,
+                            days_contagious, engine, draws, topology),
+            output)
+    elif task_type == "sweep":
+        try:
+            rates = ([infection_rate] if sweep_infection_rates is None
+                     else parse_values(sweep_infection_rates, float))
+            contagious = ([days_contagious] if sweep_days_contagious is None
+                          else parse_values(sweep_days_contagious, int))
+        except ValueError:
+            print("Error: sweep values must be comma-separated numbers")
+            return -1
+        write_sweep_csv(
+            sweep_avg_num_newly_infected(city, random_seed, max_num_days,
+                                         rates, contagious, num_trials),
+            output)
+    elif task_type == "exact":
+        if isinstance(city, tuple):
+            city = arrays_to_city(*city)
+        try:
+            avg_infected = exact_avg_num_newly_infected(
+                city, max_num_days, infection_rate, days_contagious)
+        except ValueError as e:
+            print(e)
+            return -1
+        print("Exactly {:.3f} people are infected on average"
+              .format(avg_infected))
+    elif task_type == "adaptive":
+        print("Running trials until the estimate is precise enough...")
+        avg_infected, half_width, trials_run = \
+            calc_avg_num_newly_infected_adaptive(
+                city, random_seed, max_num_days, infection_rate,
+                days_contagious, tolerance, max_trials, confidence,
+                draws=draws)
+        msg = ("Over {} trial(s), on average, {:3.1f} people were infected"
+               " (+/- {:.3f} at {:.0%} confidence)")
+        print(msg.format(trials_run, avg_infected, half_width, confidence))
     else:
         print("Running multiple trials...")
         avg_infected = calc_avg_num_newly_infected(
             city, random_seed, max_num_days, infection_rate,
-            days_contagious, num_trials)
+            days_contagious, num_trials, workers, draws, topology)
         msg = "Over {} trial(s), on average, {:3.1f} people were infected"
         print(msg.format(num_trials, avg_infected))
 
@@ -0,0 +1,515 @@
+'''
+Epidemic modelling: test code for sir
+
+Every faster path of sir.py is checked against the original
+list-of-strings simulation, which advances one person at a time with
+advance_person_at_position.
+'''
+
+import io
+import os
+import random
+import sys
+from fractions import Fraction
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+# Handle the fact that the grading code may not
+# be in the same directory as implementation
+sys.path.insert(0, os.getcwd())
+
+import sir
+
+# DO NOT REMOVE THESE LINES OF CODE
+# pylint: disable-msg= invalid-name, missing-docstring, too-many-arguments
+
+
+def make_cities(seed, count):
+    rng = random.Random(seed)
+    cities = []
+    for _ in range(count):
+        city = [rng.choice(["S", "S", "S", "I0", "I1", "I2", "R"])
+                for _ in range(rng.randint(1, 30))]
+        cities.append((city, rng.randint(0, 1000), rng.randint(1, 12),
+                       rng.choice([0.2, 0.5, 0.8, 1.0]), rng.randint(1, 4)))
+    return cities
+
+
+CITIES = make_cities(0, 40)
+
+
+def baseline_simulation(city, random_seed, max_num_days, infection_rate,
+                        days_contagious, topology=None):
+    random.seed(random_seed)
+    s_counter = 0
+    while s_counter < max_num_days:
+        new_city = [sir.advance_person_at_position(
+            city, position, infection_rate, days_contagious, topology)
+                    for position in range(len(city))]
+        s_counter = s_counter + 1
+        if new_city == city:
+            break
+        city = new_city
+    return city, s_counter
+
+
+def baseline_avg(city, random_seed, max_num_days, infection_rate,
+                 days_contagious, num_trials):
+    total = 0
+    for trial in range(num_trials):
+        final_city, _ = baseline_simulation(city, random_seed + trial,
+                                            max_num_days, infection_rate,
+                                            days_contagious)
+        total += sum(1 for before, after in zip(city, final_city)
+                     if before == "S" and after != "S")
+    return total / num_trials
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_dense_engine(city, seed, days, rate, contagious):
+    expected = baseline_simulation(city, seed, days, rate, contagious)
+    assert sir.run_simulation(city, seed, days, rate, contagious,
+                              "dense") == expected
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_frontier_engine(city, seed, days, rate, contagious):
+    expected = baseline_simulation(city, seed, days, rate, contagious)
+    assert sir.run_simulation(city, seed, days, rate, contagious,
+                              "frontier") == expected
+    (states, days_infected), num_days = sir.run_simulation(
+        sir.city_to_arrays(city), seed, days, rate, contagious, "frontier")
+    assert (sir.arrays_to_city(states, days_infected), num_days) == expected
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_bitset_engine(city, seed, days, rate, contagious):
+    expected = baseline_simulation(city, seed, days, rate, contagious)
+    assert sir.run_simulation(city, seed, days, rate, contagious,
+                              "bitset") == expected
+    (states, days_infected), num_days = sir.run_simulation(
+        sir.city_to_arrays(city), seed, days, rate, contagious, "bitset")
+    assert (sir.arrays_to_city(states, days_infected), num_days) == expected
+
+
+def test_bitset_long_contagion():
+    city = (["S"] * 7 + ["I3"]) * 40
+    expected = baseline_simulation(city, 5, 6, 0.5, 10 ** 6)
+    assert sir.run_simulation(city, 5, 6, 0.5, 10 ** 6, "bitset") == expected
+
+    # Only the days on which someone was infected are held as stages.
+    random.seed(5)
+    engine = sir.BitsetEngine(*sir.city_to_arrays(city), 10 ** 6)
+    for _ in range(6):
+        engine.step(0.5)
+    assert len(engine.stages) <= 7
+    assert sir.arrays_to_city(*engine.arrays()) == expected[0]
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_array_form(city, seed, days, rate, contagious):
+    expected = baseline_simulation(city, seed, days, rate, contagious)
+    states, days_infected = sir.city_to_arrays(city)
+    assert days_infected.dtype == sir.DAYS_DTYPE
+    assert sir.arrays_to_city(states, days_infected) == city
+
+    (states, days_infected), num_days = sir.run_simulation(
+        (states, days_infected), seed, days, rate, contagious)
+    assert days_infected.dtype == sir.DAYS_DTYPE
+    assert (sir.arrays_to_city(states, days_infected), num_days) == expected
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_batched_average(city, seed, days, rate, contagious):
+    expected = baseline_avg(city, seed, days, rate, contagious, 20)
+    assert sir.calc_avg_num_newly_infected(city, seed, days, rate,
+                                           contagious, 20) == expected
+
+
+def test_worker_average():
+    city, seed, days, rate, contagious = CITIES[0]
+    expected = baseline_avg(city, seed, days, rate, contagious, 30)
+    assert sir.calc_avg_num_newly_infected(city, seed, days, rate,
+                                           contagious, 30, workers=3) \
+        == expected
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_rle_form(city, seed, days, rate, contagious):
+    expected_city, expected_days = baseline_simulation(city, seed, days,
+                                                       rate, contagious)
+    rle_city, num_days = sir.run_simulation(sir.RLECity.from_city(city),
+                                            seed, days, rate, contagious)
+    assert (rle_city.to_city(), num_days) == (expected_city, expected_days)
+
+
+def test_rle_runs():
+    rle_city = sir.RLECity([("S", 2), ("I1", 0), ("S", 1), ("R", 3)])
+    assert rle_city.to_city() == ["S", "S", "S", "R", "R", "R"]
+    assert rle_city.runs() == [("S", 3), ("R", 3)]
+    for runs in [[("X", 2)], [("I", 3)], [("S", 2), ("R", -1)]]:
+        with pytest.raises(ValueError):
+            sir.RLECity(runs)
+
+
+def baseline_day_counts(city, random_seed, max_num_days, infection_rate,
+                        days_contagious):
+    random.seed(random_seed)
+    counts = []
+    while len(counts) < max_num_days:
+        new_city = [sir.advance_person_at_position(
+            city, position, infection_rate, days_contagious)
+                    for position in range(len(city))]
+        changes = list(zip(city, new_city))
+        counts.append(sir.DayCounts(
+            len(counts) + 1,
+            sum(1 for before, after in changes
+                if before == "S" and after != "S"),
+            sum(1 for before, after in changes
+                if before[0] == "I" and after == "R"),
+            sum(1 for person in new_city if person[0] == "I")))
+        if new_city == city:
+            break
+        city = new_city
+    return counts
+
+
+@pytest.mark.parametrize("engine", list(sir.ENGINES))
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:20])
+def test_day_counts(engine, city, seed, days, rate, contagious):
+    expected = baseline_day_counts(city, seed, days, rate, contagious)
+    day_counts = []
+    _, num_days = sir.run_simulation(city, seed, days, rate, contagious,
+                                     engine, day_counts=day_counts)
+    assert day_counts == expected
+    assert num_days == len(expected)
+
+
+def sir_counts(day, city):
+    return sir.SIRCounts(day, city.count("S"),
+                         sum(1 for person in city if person[0] == "I"),
+                         city.count("R"))
+
+
+def baseline_series(city, random_seed, max_num_days, infection_rate,
+                    days_contagious):
+    random.seed(random_seed)
+    series = [sir_counts(0, city)]
+    while len(series) <= max_num_days:
+        new_city = [sir.advance_person_at_position(
+            city, position, infection_rate, days_contagious)
+                    for position in range(len(city))]
+        series.append(sir_counts(len(series), new_city))
+        if new_city == city:
+            break
+        city = new_city
+    return series
+
+
+@pytest.mark.parametrize("engine", list(sir.ENGINES))
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:20])
+def test_simulate_series(engine, city, seed, days, rate, contagious):
+    expected = baseline_series(city, seed, days, rate, contagious)
+    assert list(sir.simulate_series(city, seed, days, rate, contagious,
+                                    engine)) == expected
+    if engine == "frontier":
+        assert list(sir.simulate_series(sir.RLECity.from_city(city), seed,
+                                        days, rate, contagious)) == expected
+
+
+def test_write_series_csv():
+    f = io.StringIO()
+    sir.write_series_csv(sir.simulate_series(["S", "I0", "R"], 1, 5, 1.0, 1),
+                         f)
+    assert f.getvalue().splitlines() == ["day,susceptible,infected,recovered",
+                                         "0,1,1,1", "1,0,1,2", "2,0,0,3",
+                                         "3,0,0,3"]
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_city_files(tmp_path, city, seed, days, rate, contagious):
+    states, days_infected = sir.city_to_arrays(city)
+    binary_file = str(tmp_path / "city.bin")
+    sir.write_city_file(binary_file, states, days_infected)
+    text_file = str(tmp_path / "city.txt")
+    with open(text_file, "w") as f:
+        f.write(",".join(city) + "\n")
+    for filename in [binary_file, text_file]:
+        states, days_infected = sir.read_city_file(filename)
+        assert days_infected.dtype == sir.DAYS_DTYPE
+        assert sir.arrays_to_city(states, days_infected) == city
+        (states, days_infected), num_days = sir.run_simulation(
+            filename, seed, days, rate, contagious)
+        assert (sir.arrays_to_city(states, days_infected), num_days) == \
+            baseline_simulation(city, seed, days, rate, contagious)
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_sweep_certain_rates(city, seed, days, rate, contagious):
+    sweep = sir.sweep_avg_num_newly_infected(city, seed, days, [0.0, 1.0],
+                                             [contagious, contagious + 2], 5)
+    for sweep_rate, sweep_contagious, avg in sweep:
+        assert avg == sir.calc_avg_num_newly_infected(
+            city, seed, days, sweep_rate, sweep_contagious, 5)
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_sweep_monotone_in_rate(city, seed, days, rate, contagious):
+    # With no one recovering during the simulation, the draws shared by
+    # all rates infect a superset of the people at every higher rate.
+    contagious = days + 3
+    rates = [0.0, 0.1, 0.3, 0.5, 0.7, 0.9, 1.0]
+    sweep = sir.sweep_avg_num_newly_infected(city, seed, days, rates,
+                                             [contagious], 10)
+    averages = [avg for _, _, avg in sweep]
+    assert averages == sorted(averages)
+
+
+ADAPTIVE_CITY = ["S"] * 6 + ["I0"] + ["S"] * 6
+
+
+@pytest.mark.parametrize("max_trials", [1, 29, 30, 45, 130])
+def test_adaptive_average(max_trials):
+    # A tolerance of zero is never met, so every trial is run.
+    avg, _, num_trials = sir.calc_avg_num_newly_infected_adaptive(
+        ADAPTIVE_CITY, 3, 10, 0.5, 3, 0, max_trials)
+    assert num_trials == max_trials
+    assert avg == sir.calc_avg_num_newly_infected(ADAPTIVE_CITY, 3, 10, 0.5,
+                                                  3, max_trials)
+
+
+def test_adaptive_tolerance():
+    avg, half_width, num_trials = sir.calc_avg_num_newly_infected_adaptive(
+        ADAPTIVE_CITY, 3, 10, 0.5, 3, 0.5, 10000)
+    assert half_width <= 0.5
+    assert sir.MIN_ADAPTIVE_TRIALS < num_trials < 10000
+    assert avg == sir.calc_avg_num_newly_infected(ADAPTIVE_CITY, 3, 10, 0.5,
+                                                  3, num_trials)
+
+    # A certain outcome meets any tolerance after the first batch.
+    assert sir.calc_avg_num_newly_infected_adaptive(
+        ADAPTIVE_CITY, 3, 10, 1.0, 3, 0, 10000) == \
+        (12, 0, sir.MIN_ADAPTIVE_TRIALS)
+
+
+def test_exact():
+    assert sir.exact_avg_num_newly_infected(
+        ["S", "I0", "S"], 5, Fraction(1, 3), 1) == Fraction(2, 3)
+    city = ["S", "I1", "S", "S", "R", "I0", "S"]
+    distribution = sir.exact_newly_infected_distribution(city, 6, 0.5, 3)
+    assert sum(distribution.values()) == pytest.approx(1)
+    assert sir.exact_avg_num_newly_infected(city, 6, 0.5, 3) == \
+        pytest.approx(baseline_avg(city, 0, 6, 0.5, 3, 5000), abs=0.1)
+
+
+@pytest.mark.parametrize("text,contagious", [
+    ("S" * 20 + "I" + "S" * 20, 10), ("SISSISSSISSSSISRSSISS", 3)])
+def test_exact_refuses_large_cities(text, contagious):
+    city = ["I0" if person == "I" else person for person in text]
+    with pytest.raises(ValueError):
+        sir.exact_avg_num_newly_infected(city, 30, 0.5, contagious)
+
+
+def test_segments_split_the_city():
+    # With a certain infection, segments give the same result as one
+    # process no matter where the city is split.
+    city = ["S"] * 9 + ["I0"] + ["S"] * 5 + ["R"] + ["S"] * 4
+    expected = baseline_simulation(city, 1, 20, 1.0, 2)
+    assert sir.run_simulation_parallel(city, 1, 20, 1.0, 2, 3) == expected
+    (states, days_infected), num_days = sir.run_simulation_parallel(
+        sir.city_to_arrays(city), 1, 20, 1.0, 2, 3)
+    assert days_infected.dtype == sir.DAYS_DTYPE
+    assert (sir.arrays_to_city(states, days_infected), num_days) == expected
+
+
+def test_batched_block_draws():
+    city, seed, days, rate, contagious = CITIES[1]
+    counts = sir.count_newly_infected_batch(
+        *sir.city_to_arrays(city), [seed, seed + 1], days, rate, contagious,
+        draws="block")
+    for trial, count in enumerate(counts.tolist()):
+        final_city, _ = sir.run_simulation(city, seed + trial, days, rate,
+                                           contagious, draws="block")
+        assert count == sum(1 for before, after in zip(city, final_city)
+                            if before == "S" and after != "S")
+
+
+def test_block_draws_sizes():
+    draw = sir.BlockDraws(7)
+    draws = np.concatenate([draw(count) for count in [3, 0, 1, 70000, 5]])
+    assert (draws == np.random.default_rng(7).random(len(draws))).all()
+    assert len(sir.BlockDraws(7, block_size=4)(3)) == 3
+    # Blocks only grow as large as the draws asked for.
+    draw = sir.BlockDraws(7)
+    draw(3)
+    assert len(draw.block) < sir.RANDOM_BLOCK_SIZE
+
+
+def test_worker_block_draws():
+    city, seed, days, rate, contagious = CITIES[0]
+    assert sir.calc_avg_num_newly_infected(
+        city, seed, days, rate, contagious, 30, workers=3,
+        draws="block") == sir.calc_avg_num_newly_infected(
+            city, seed, days, rate, contagious, 30, draws="block")
+
+
+BATCH_DEFAULTS = {"random_seed": 1, "max_num_days": 5, "infection_rate": 0.5,
+                  "days_contagious": 2, "num_trials": 1, "engine": "dense",
+                  "draws": "compat", "task_type": "single"}
+
+
+def test_batch_errors():
+    result = sir.run_batch_line('{"city": "S,I0", "engine": "fast"}',
+                                BATCH_DEFAULTS)
+    assert "engine" in result["error"]
+    result = sir.run_batch_line('{"city": "S,I0", "draws": "fast"}',
+                                BATCH_DEFAULTS)
+    assert "draws" in result["error"]
+    result = sir.run_batch_line('{"city": "S,I0,S"}', BATCH_DEFAULTS)
+    assert (result["final_city"], result["days_simulated"]) == \
+        baseline_simulation(["S", "I0", "S"], 1, 5, 0.5, 2)
+
+
+def test_batch_workers():
+    lines = ['{{"city": "{}", "random_seed": {}}}'.format(",".join(city), seed)
+             for city, seed, _, _, _ in CITIES * 5]
+    num_read = [0]
+
+    def read_lines():
+        for line in lines:
+            num_read[0] += 1
+            yield line
+
+    results = sir.run_batch(read_lines(), BATCH_DEFAULTS, workers=2)
+    assert next(results) == sir.run_batch_line(lines[0], BATCH_DEFAULTS)
+    # Only a bounded window of lines is read ahead of the results.
+    assert num_read[0] <= sir.BATCH_CHUNK_SIZE * (
+        sir.BATCH_CHUNKS_PER_WORKER * 2 + 1)
+    assert list(results) == list(sir.run_batch(lines[1:], BATCH_DEFAULTS))
+
+
+def run_form(form, city, seed, days, rate, contagious, engine, draws,
+             **kwargs):
+    if form == "rle":
+        city = sir.RLECity.from_city(city)
+    elif form == "arrays":
+        city = sir.city_to_arrays(city)
+    final_city, num_days = sir.run_simulation(city, seed, days, rate,
+                                              contagious, engine,
+                                              draws=draws, **kwargs)
+    return as_list(final_city), num_days
+
+
+def as_list(city):
+    if isinstance(city, sir.RLECity):
+        return city.to_city()
+    if isinstance(city, tuple):
+        return sir.arrays_to_city(*city)
+    return city
+
+
+# An RLECity is always advanced with the frontier engine.
+FORMS = ([("list", engine) for engine in sir.ENGINES]
+         + [("arrays", engine) for engine in sir.ENGINES]
+         + [("rle", "frontier")])
+
+
+@pytest.mark.parametrize("form,engine", FORMS)
+@pytest.mark.parametrize("draws", sir.DRAW_MODES)
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_checkpoint_resume(tmp_path, monkeypatch, form, engine, draws,
+                           city, seed, days, rate, contagious):
+    monkeypatch.setattr(sir, "CHECKPOINT_COST_RATIO", 0)
+    checkpoint = str(tmp_path / "checkpoint.npz")
+    expected = run_form(form, city, seed, days, rate, contagious, engine,
+                        draws)
+    if draws == "compat":
+        assert expected == baseline_simulation(city, seed, days, rate,
+                                               contagious)
+
+    for stop in range(1, days + 1):
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        run_form(form, city, seed, stop, rate, contagious, engine, draws,
+                 checkpoint_file=checkpoint, checkpoint_interval=0)
+        if not os.path.exists(checkpoint):
+            continue
+        final_city, num_days = sir.resume_simulation(checkpoint, days, engine)
+        assert (as_list(final_city), num_days) == expected
+
+
+@pytest.mark.parametrize("engine", ["dense", "frontier"])
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES)
+def test_topology_line(engine, city, seed, days, rate, contagious):
+    expected = baseline_simulation(city, seed, days, rate, contagious)
+    assert sir.run_simulation(city, seed, days, rate, contagious, engine,
+                              topology=sir.Topology.line(len(city))) \
+        == expected
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_topology_grid(city, seed, days, rate, contagious):
+    city = (city * 4)[:24]
+    topology = sir.Topology.grid(4, 6)
+    expected = baseline_simulation(city, seed, days, rate, contagious,
+                                   topology)
+    for engine in ["dense", "frontier"]:
+        assert sir.run_simulation(city, seed, days, rate, contagious,
+                                  engine, topology=topology) == expected
+
+
+def random_edges(seed, num_people, num_edges):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, num_people, size=(num_edges, 2))
+
+
+@pytest.mark.parametrize("city,seed,days,rate,contagious", CITIES[:10])
+def test_edge_files(tmp_path, city, seed, days, rate, contagious):
+    edges = random_edges(seed, len(city), 2 * len(city))
+    topology = sir.Topology.from_edges(len(city), edges)
+    npy_file = str(tmp_path / "edges.npy")
+    np.save(npy_file, edges)
+    text_file = str(tmp_path / "edges.txt")
+    np.savetxt(text_file, edges, fmt="%d")
+
+    expected = baseline_simulation(city, seed, days, rate, contagious,
+                                   topology)
+    for filename in [npy_file, text_file]:
+        read = sir.Topology.read_edges(filename, len(city))
+        assert (read.indptr == topology.indptr).all()
+        assert (read.indices == topology.indices).all()
+        assert sir.run_simulation(city, seed, days, rate, contagious,
+                                  "frontier", topology=read) == expected
+
+
+def test_edges_out_of_range(tmp_path):
+    for edges in [[[0, 3]], [[-1, 1]]]:
+        with pytest.raises(ValueError):
+            sir.Topology.from_edges(3, edges)
+    text_file = str(tmp_path / "edges.txt")
+    with open(text_file, "w") as f:
+        f.write("0 1\n1 3\n")
+    with pytest.raises(ValueError):
+        sir.Topology.read_edges(text_file, 3)
+
+
+def test_edges_file_option(tmp_path):
+    city = ["S", "I0", "S", "S", "S"]
+    edges = [[1, 4], [4, 3]]
+    filename = str(tmp_path / "edges.txt")
+    np.savetxt(filename, edges, fmt="%d")
+    expected_city, expected_days = baseline_simulation(
+        city, 1, 5, 1.0, 2, sir.Topology.from_edges(len(city), edges))
+
+    result = CliRunner().invoke(sir.cmd, [
+        ",".join(city), "--edges-file", filename, "--random_seed", "1",
+        "--max-num-days", "5", "--infection-rate", "1.0"])
+    assert str(expected_city) in result.output
+    assert "Days simulated: {}".format(expected_days) in result.output
+
+    np.savetxt(filename, [[0, 5]], fmt="%d")
+    result = CliRunner().invoke(sir.cmd, [",".join(city), "--edges-file",
+                                          filename])
+    assert "contacts must be between people" in result.output
@@ -30,12 +30,38 @@ Sample:
                        --max_steps=1
 '''
 
+import heapq
 import os
 import sys
 import click
+import numpy as np
 import utility
 
 
+def checked_grid(grid):
+    '''
+    Check the grid argument of a function, once, at the boundary.
+
+    Inputs:
+        grid: (Grid or list of lists of strings) the grid
+
+    Returns: (Grid) the grid, which shares its rows with grid and is not
+    checked again
+    '''
+    if (isinstance(grid, utility.Grid)
+            and set(grid.allowed) <= set(utility.ALLOWED_VALUES)):
+        return grid
+    try:
+        if not isinstance(grid, list):
+            raise ValueError("Grid is not a list")
+        return utility.Grid(grid)
+    except (TypeError, ValueError):
+        raise AssertionError("The grid argument has the wrong type.  "
+                             "It should be a list of lists of strings "
+                             "with the same number of rows and columns") \
+            from None
+
+
 def boundary(grid, location, R):
     y = []
     i = location[0]
@@ -117,6 +143,410 @@ def is_satisfied(grid, R, location, simil_threshold, occup_threshold):
     return satisfaction
 
 
+def window_bounds(size, R):
+    '''
+    Find, for every index along one side of the grid, the first index in
+    its neighborhood of radius R and one past the last.
+
+    Inputs:
+        size: (int) the length of the side
+        R: (int) radius for the neighborhood
+
+    Returns: (NumPy array of ints, NumPy array of ints) the bounds
+    '''
+    positions = np.arange(size)
+    return (np.clip(positions - R, 0, size),
+            np.clip(positions + R + 1, 0, size))
+
+
+def window_sums(mask, R):
+    '''
+    Count, for every location at once, the set cells of mask in its
+    neighborhood of radius R, using a summed-area table built one axis
+    at a time.
+
+    Inputs:
+        mask: (2-D NumPy array of bool) the cells to count
+        R: (int) radius for the neighborhood
+
+    Returns: (2-D NumPy array of ints) the count for each location
+    '''
+    rows, cols = mask.shape
+    dtype = np.int32 if mask.size < 2 ** 31 else np.int64
+
+    table = np.zeros((rows + 1, cols), dtype=dtype)
+    np.cumsum(mask, axis=0, dtype=dtype, out=table[1:])
+    top, bottom = window_bounds(rows, R)
+    strips = table[bottom] - table[top]
+
+    table = np.zeros((rows, cols + 1), dtype=dtype)
+    np.cumsum(strips, axis=1, out=table[:, 1:])
+    left, right = window_bounds(cols, R)
+    return table[:, right] - table[:, left]
+
+
+def score_maps(codes, R):
+    '''
+    Compute the similarity and occupancy scores of every location at
+    once.
+
+    Inputs:
+        codes: (2-D NumPy array) the grid in array form
+        R: (int) radius for the neighborhood
+
+    Returns: (2-D NumPy array of floats, 2-D NumPy array of floats) the
+    similarity score of every home (NaN for open locations) and the
+    occupancy score of every location.
+    '''
+    occupied = codes != utility.OPEN_CODE
+    top, bottom = window_bounds(codes.shape[0], R)
+    left, right = window_bounds(codes.shape[1], R)
+    num_homes = np.outer(bottom - top, right - left)
+
+    # Every occupied home belongs to one group, so the occupied homes of
+    # a neighborhood are the sum of its groups.
+    num_occupied = 0
+    num_similar = 0
+    for code in utility.HOMEOWNER_CODES:
+        members = codes == code
+        num_members = window_sums(members, R)
+        num_occupied = num_occupied + num_members
+        num_similar = num_similar + num_members * members
+
+    similarity = np.divide(num_similar, num_occupied,
+                           out=np.full(codes.shape, np.nan), where=occupied)
+    return similarity, num_occupied / num_homes
+
+
+def satisfaction_map(codes, R, simil_threshold, occup_threshold):
+    '''
+    Determine whether the homeowner at every location is satisfied.
+
+    Inputs:
+        codes: (2-D NumPy array) the grid in array form
+        R: (int) radius for the neighborhood
+        simil_threshold: (float) lower bound for similarity score
+        occup_threshold: (float) lower bound for occupancy score
+
+    Returns: (2-D NumPy array of bool) True at the locations of satisfied
+    homeowners, False at the others and at open locations.
+    '''
+    similarity, occupancy = score_maps(codes, R)
+    return (similarity >= simil_threshold) & (occupancy >= occup_threshold)
+
+
+class NeighborhoodCounts:
+    '''
+    Running counts, for every location, of the homeowners of each group
+    and of the occupied homes in its neighborhood, kept up to date as
+    homeowners relocate so that satisfaction can be checked in constant
+    time.
+    '''
+
+    def __init__(self, grid, R):
+        '''
+        Count the neighborhoods of every location of a grid.
+
+        Inputs:
+            grid: (list of lists of strings) the grid
+            R: (int) radius for the neighborhood
+        '''
+        self.R = R
+        self.codes = utility.grid_to_array(grid)
+        self.num_group = {code: window_sums(self.codes == code, R)
+                          for code in utility.HOMEOWNER_CODES}
+        self.num_occupied = window_sums(self.codes != utility.OPEN_CODE, R)
+        top, bottom = window_bounds(self.codes.shape[0], R)
+        left, right = window_bounds(self.codes.shape[1], R)
+        self.num_homes = np.outer(bottom - top, right - left)
+
+    def window(self, location):
+        '''
+        Get the neighborhood of a location.
+
+        Inputs:
+            location: (int, int) a grid location
+
+        Returns: (slice, slice) the rows and columns of the neighborhood
+        '''
+        i, j = location
+        return (slice(max(i - self.R, 0), i + self.R + 1),
+                slice(max(j - self.R, 0), j + self.R + 1))
+
+    def is_satisfied(self, location, simil_threshold, occup_threshold):
+        '''
+        Determine whether the homeowner at a location is satisfied, like
+        is_satisfied.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+            simil_threshold: (float) lower bound for similarity score
+            occup_threshold: (float) lower bound for occupancy score
+
+        Returns: Boolean
+        '''
+        num_similar = int(self.num_group[self.codes[location]][location])
+        num_occupied = int(self.num_occupied[location])
+        return (num_similar / num_occupied >= simil_threshold
+                and num_occupied / int(self.num_homes[location])
+                >= occup_threshold)
+
+    def would_be_satisfied(self, location, target, simil_threshold,
+                           occup_threshold):
+        '''
+        Determine whether the homeowner at a location would be satisfied
+        after moving to an open location, accounting for the home they
+        leave open.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+            target: (int, int) an open location
+            simil_threshold: (float) lower bound for similarity score
+            occup_threshold: (float) lower bound for occupancy score
+
+        Returns: Boolean
+        '''
+        num_similar = int(self.num_group[self.codes[location]][target]) + 1
+        num_occupied = int(self.num_occupied[target]) + 1
+        if (abs(location[0] - target[0]) <= self.R
+                and abs(location[1] - target[1]) <= self.R):
+            num_similar = num_similar - 1
+            num_occupied = num_occupied - 1
+        return (num_similar / num_occupied >= simil_threshold
+                and num_occupied / int(self.num_homes[target])
+                >= occup_threshold)
+
+    def occupied_near(self, location):
+        '''
+        Find the homeowners in the neighborhood of a location.
+
+        Inputs:
+            location: (int, int) a grid location
+
+        Returns: (list of tuples) the locations of the homeowners
+        '''
+        rows, cols = self.window(location)
+        return [(i + rows.start, j + cols.start) for i, j in np.argwhere(
+            self.codes[rows, cols] != utility.OPEN_CODE).tolist()]
+
+    def move(self, location, target):
+        '''
+        Relocate the homeowner at a location to an open location,
+        updating the counts of the neighborhoods around both.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+            target: (int, int) an open location
+        '''
+        code = self.codes[location]
+        self.num_group[code][self.window(location)] -= 1
+        self.num_occupied[self.window(location)] -= 1
+        self.num_group[code][self.window(target)] += 1
+        self.num_occupied[self.window(target)] += 1
+        self.codes[target] = code
+        self.codes[location] = utility.OPEN_CODE
+
+
+class OpenSuitability:
+    '''
+    An index of the open locations on the market where a homeowner of
+    each group would be satisfied, kept up to date as homeowners
+    relocate.
+
+    The index assumes the homeowner comes from outside the neighborhood
+    of the open location.  The few open locations near the home being
+    left are checked again when looking up the candidates of a
+    homeowner.
+
+    The suitable locations are held both as flags over the grid, for
+    lookups, and as a set per group, so that listing the candidates of
+    a homeowner takes time in the number of suitable locations rather
+    than the size of the grid.
+    '''
+
+    def __init__(self, counts, simil_threshold, occup_threshold,
+                 opens=None):
+        '''
+        Index the open locations of a grid.
+
+        Inputs:
+            counts: (NeighborhoodCounts) the counts of the grid, kept up
+              to date with it
+            simil_threshold: (float) lower bound for similarity score
+            occup_threshold: (float) lower bound for occupancy score
+            opens: (iterable of pairs) the open locations on the market,
+              the only ones homeowners may relocate to.  Every open
+              location of the grid if not given.
+        '''
+        self.counts = counts
+        self.simil_threshold = simil_threshold
+        self.occup_threshold = occup_threshold
+        if opens is None:
+            self.on_market = counts.codes == utility.OPEN_CODE
+        else:
+            self.on_market = np.zeros(counts.codes.shape, dtype=bool)
+            for location in opens:
+                self.on_market[tuple(location)] = True
+        everywhere = (slice(None), slice(None))
+        self.flags = {code: self.suitable_mask(code, everywhere)
+                      for code in utility.HOMEOWNER_CODES}
+        self.suitable = {code: set(map(tuple, np.argwhere(flags).tolist()))
+                         for code, flags in self.flags.items()}
+
+    def suitable_mask(self, code, window):
+        '''
+        Determine where in a window of the grid a homeowner of a group
+        from outside the neighborhood would be satisfied, with the same
+        arithmetic as NeighborhoodCounts.would_be_satisfied.
+
+        Inputs:
+            code: (int) the group of the homeowner
+            window: (slice, slice) the rows and columns of the window
+
+        Returns: (2-D NumPy array of bool) True at the suitable open
+        locations of the window
+        '''
+        counts = self.counts
+        num_similar = counts.num_group[code][window] + 1
+        num_occupied = counts.num_occupied[window] + 1
+        return (self.open_mask(window)
+                & (num_similar / num_occupied >= self.simil_threshold)
+                & (num_occupied / counts.num_homes[window]
+                   >= self.occup_threshold))
+
+    def open_mask(self, window):
+        '''
+        Find the open locations on the market in a window of the grid.
+
+        Inputs:
+            window: (slice, slice) the rows and columns of the window
+
+        Returns: (2-D NumPy array of bool) True at the open locations
+        '''
+        return ((self.counts.codes[window] == utility.OPEN_CODE)
+                & self.on_market[window])
+
+    def update(self, location, target):
+        '''
+        Update the index after the homeowner at a location relocated to
+        an open location and the counts were updated, which can only
+        change the open locations in the neighborhoods of the two.  The
+        home left open goes on the market and the one taken comes off.
+
+        Inputs:
+            location: (int, int) the home that was left open
+            target: (int, int) the home that was taken
+        '''
+        self.on_market[location] = True
+        self.on_market[target] = False
+        for window in (self.counts.window(location),
+                       self.counts.window(target)):
+            for code, flags in self.flags.items():
+                mask = self.suitable_mask(code, window)
+                changed = mask != flags[window]
+                suitable = self.suitable[code]
+                for i, j in np.argwhere(changed).tolist():
+                    home = (i + window[0].start, j + window[1].start)
+                    if mask[i, j]:
+                        suitable.add(home)
+                    else:
+                        suitable.discard(home)
+                flags[window] = mask
+
+    def candidates(self, location):
+        '''
+        Find the open locations where the homeowner at a location would
+        be satisfied, accounting for the home they would leave open.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+
+        Returns: (list of tuples) the open locations, in no particular
+        order
+        '''
+        counts = self.counts
+        R = counts.R
+        near = counts.window(location)
+        homes = [(i, j) for i, j in self.suitable[counts.codes[location]]
+                 if abs(i - location[0]) > R or abs(j - location[1]) > R]
+        for i, j in np.argwhere(self.open_mask(near)).tolist():
+            home = (i + near[0].start, j + near[1].start)
+            if counts.would_be_satisfied(location, home, self.simil_threshold,
+                                         self.occup_threshold):
+                homes.append(home)
+        return homes
+
+    def is_candidate(self, location, home):
+        '''
+        Determine whether the homeowner at a location would be satisfied
+        after moving to a home, which must be open.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+            home: (int, int) a grid location
+
+        Returns: Boolean
+        '''
+        counts = self.counts
+        if (counts.codes[home] != utility.OPEN_CODE
+                or not self.on_market[home]):
+            return False
+        if (abs(home[0] - location[0]) <= counts.R
+                and abs(home[1] - location[1]) <= counts.R):
+            return counts.would_be_satisfied(location, home,
+                                             self.simil_threshold,
+                                             self.occup_threshold)
+        return bool(self.flags[counts.codes[location]][home])
+
+    def count_candidates(self, location):
+        '''
+        Count the open locations where the homeowner at a location would
+        be satisfied, without listing them.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+
+        Returns: (int) the number of open locations
+        '''
+        counts = self.counts
+        code = counts.codes[location]
+        near = counts.window(location)
+        num_candidates = (len(self.suitable[code])
+                          - int(np.count_nonzero(self.flags[code][near])))
+        for i, j in np.argwhere(self.open_mask(near)).tolist():
+            if counts.would_be_satisfied(
+                    location, (i + near[0].start, j + near[1].start),
+                    self.simil_threshold, self.occup_threshold):
+                num_candidates = num_candidates + 1
+        return num_candidates
+
+    def nearest_candidates(self, location):
+        '''
+        Search outward from a homeowner, one ring of locations at the
+        same Manhattan distance at a time, for the closest open locations
+        where they would be satisfied.
+
+        Inputs:
+            location: (int, int) the location of a homeowner
+
+        Returns: (list of tuples) the candidates at the smallest
+        distance, or an empty list if there are none
+        '''
+        rows, cols = self.counts.codes.shape
+        i, j = location
+        for distance in range(1, rows + cols - 1):
+            homes = []
+            for k in range(max(i - distance, 0),
+                           min(i + distance, rows - 1) + 1):
+                offset = distance - abs(k - i)
+                for l in sorted({j - offset, j + offset}):
+                    if 0 <= l < cols and self.is_candidate(location, (k, l)):
+                        homes.append((k, l))
+            if homes:
+                return homes
+        return []
+
+
 def av_houses(opens, n):
     '''
     Do Available houses with least time in the market
@@ -137,7 +567,8 @@ def av_houses(opens, n):
     least_market = max(options)
     return least_market
 
-def house_satis(grid, R, simil_threshold, occup_threshold, opens, i, s):
+def house_satis(grid, R, simil_threshold, occup_threshold, opens, i, s,
+                counts=None, suitability=None):
     '''
     Do house satisfaction
 
@@ -149,10 +580,22 @@ def house_satis(grid, R, simil_threshold, occup_threshold, opens, i, s):
         opens: (list of tuples) a list of open locations
         i: row location
         s: column location
+        counts: (NeighborhoodCounts) if given, the counts of the grid,
+          used instead of trying the homeowner in every open location
+        suitability: (OpenSuitability) if given, the index of the open
+          locations of the grid, whose candidates are looked up instead.
+          It must index the open locations in opens.
 
     Returns:
         list of houses that satisfy the homeowner
     '''
+    if suitability is not None:
+        return suitability.candidates((i, s))
+    if counts is not None:
+        return [item for item in opens
+                if counts.would_be_satisfied((i, s), item, simil_threshold,
+                                             occup_threshold)]
+
     true = []
 
     for j, item in enumerate(opens):
@@ -165,60 +608,85 @@ def house_satis(grid, R, simil_threshold, occup_threshold, opens, i, s):
             true.append(item)
     return true
 
-def step1(grid, R, simil_threshold, occup_threshold, max_steps, opens):
+def step1(grid, R, simil_threshold, occup_threshold, max_steps, opens,
+          counts=None, suitability=None, dirty=None):
+    '''
+    Do one pass over the city, relocating the unsatisfied homeowners in
+    order, row by row.
+
+    Only the homeowners that may be unsatisfied are visited: those in
+    dirty and those near a relocation made earlier in the pass, which
+    are added to dirty.  Every other homeowner is satisfied, so skipping
+    them leaves the relocations unchanged.
+
+    Inputs:
+        grid: (list of lists of strings) the grid
+        R: (int) radius for the neighborhood
+        simil_threshold: (float) Similarity threshold
+        occup_threshold: (float) Occupancy threshold
+        max_steps: (int) maximum number of steps to do
+        opens: (OpenLocations or list of tuples) the open locations on
+          the market, in the order they were listed, updated as
+          homeowners relocate.  Homeowners only relocate to these.
+        counts: (NeighborhoodCounts) the counts of the grid, kept up to
+          date with it.  Counted from the grid if not given.
+        suitability: (OpenSuitability) the index of the open locations
+          in opens, built on counts and kept up to date with it.  Built
+          from counts and opens if not given.
+        dirty: (set of tuples) the locations of the homeowners that may
+          be unsatisfied, updated to those that may still be after the
+          pass.  Every homeowner is visited if not given.
+
+    Returns:
+        The number of relocations completed.
+    '''
     N = int(len(grid))
     contador = 0
-
-    for i in range(0, N):
-        for s in range(0, N):
-            if grid[i][s] != 'O':
-                y = is_satisfied(grid, R, (i, s), simil_threshold,
-                                 occup_threshold)
-                if not y:
-                    z = 0
-                    r = 0
-                    f = []
-                    t = []
-                    n = []
-                    true = house_satis(grid, R, simil_threshold,
-                                       occup_threshold, opens, i, s)
-                    if len(true) <= 1:
-                        pass
-                    else:
-                        for k in true:
-                            a = (k[1]- s)
-                            b = (k[0]- i)
-                            if a < 0:
-                                a = -a
-                            if b < 0:
-                                b = -b
-                            z = a + b
-                            t.append(z)
-                            g = min(t)
-                        if not len(t) <= 1:
-                            for k in true:
-                                a = (k[1]- s)
-                                b = (k[0]- i)
-                                if a < 0:
-                                    a = -a
-                                if b < 0:
-                                    b = -b
-                                z = a + b
-                                if z == g:
-                                    n.append(k)
-                            least_market = av_houses(opens, n)
-                            for o, avhouses in enumerate(opens):
-                                if o == least_market:
-                                    realocate = avhouses
-                                    grid[realocate[0]][realocate[1]] = grid[i][s]
-                                    grid[i][s] = 'O'
-                            opens.remove(realocate)
-                            opens.append((i, s))
-                            contador = contador + 1
-                else:
-                    pass
-            else:
-                pass
+    listed = opens
+    if not isinstance(opens, utility.OpenLocations):
+        listed = utility.OpenLocations(opens)
+    if counts is None:
+        counts = NeighborhoodCounts(grid, R)
+    if suitability is None:
+        suitability = OpenSuitability(counts, simil_threshold,
+                                      occup_threshold, listed)
+
+    if dirty is None:
+        dirty = {(i, s) for i in range(0, N) for s in range(0, N)
+                 if grid[i][s] != 'O'}
+
+    # The locations still to visit in this pass, in row-major order.
+    pending = list(dirty)
+    heapq.heapify(pending)
+    queued = set(pending)
+    while pending:
+        (i, s) = heapq.heappop(pending)
+        queued.discard((i, s))
+        if grid[i][s] == 'O' or counts.is_satisfied(
+                (i, s), simil_threshold, occup_threshold):
+            dirty.discard((i, s))
+        # A homeowner only relocates when more than one open location
+        # would satisfy them.
+        elif suitability.count_candidates((i, s)) > 1:
+            n = suitability.nearest_candidates((i, s))
+            realocate = listed.most_recent(n)
+            counts.move((i, s), realocate)
+            suitability.update((i, s), realocate)
+            grid[realocate[0]][realocate[1]] = grid[i][s]
+            grid[i][s] = 'O'
+            listed.remove(realocate)
+            listed.append((i, s))
+            contador = contador + 1
+
+            dirty.discard((i, s))
+            for home in (counts.occupied_near((i, s))
+                         + counts.occupied_near(realocate)):
+                dirty.add(home)
+                if home > (i, s) and home not in queued:
+                    heapq.heappush(pending, home)
+                    queued.add(home)
+    if listed is not opens:
+        opens[:] = listed
     return contador
 
 def get_insa(grid, R, simil_threshold, occup_threshold):
@@ -226,24 +694,46 @@ def get_insa(grid, R, simil_threshold, occup_threshold):
     Determine whether or not the homeowner is unsatisfied
 
     Inputs:
-        grid: the grid
+        grid: the grid, or its array form (see utility.grid_to_array),
+          which is used as it is
         R: radius for the neighborhood
         location: a grid location
         simil_threshold: lower bound for similarity score
         occup_threshold: lower bound for occupancy score
 
-    Returns: list
+    Returns: list of the locations of the unsatisfied homeowners, row
+    by row
     '''
-    N = int(len(grid))
-    y = []
+    if isinstance(grid, np.ndarray):
+        codes = grid
+    else:
+        codes = utility.grid_to_array(checked_grid(grid))
+
+    unsatisfied = (codes != utility.OPEN_CODE) & ~satisfaction_map(
+        codes, R, simil_threshold, occup_threshold)
+    rows, cols = np.nonzero(unsatisfied)
+    return list(zip(rows.tolist(), cols.tolist()))
+
+
+def prune_satisfied(dirty, counts, simil_threshold, occup_threshold):
+    '''
+    Drop the open locations and satisfied homeowners from a set of
+    homeowners that may be unsatisfied.
+
+    Inputs:
+        dirty: (set of tuples) the locations to check, updated in place
+        counts: (NeighborhoodCounts) the counts of the grid
+        simil_threshold: (float) lower bound for similarity score
+        occup_threshold: (float) lower bound for occupancy score
+
+    Returns: (boolean) True if some homeowner is unsatisfied
+    '''
+    dirty.difference_update([
+        location for location in dirty
+        if counts.codes[location] == utility.OPEN_CODE
+        or counts.is_satisfied(location, simil_threshold, occup_threshold)])
+    return len(dirty) > 0
 
-    for i in range(0, N):
-        for j in range(0, N):
-            if(grid[i][j] != 'O'):
-                if is_satisfied(grid, R, (i, j), simil_threshold,
-                                occup_threshold) == False:
-                    y.append((i, j))
-    return y
 # DO NOT REMOVE THE COMMENT BELOW
 #pylint: disable-msg=too-many-arguments
 def do_simulation(grid, R, simil_threshold, occup_threshold, max_steps, opens):
@@ -251,32 +741,47 @@ def do_simulation(grid, R, simil_threshold, occup_threshold, max_steps, opens):
     Do a full simulation.
 
     Inputs:
-        grid: (list of lists of strings) the grid
+        grid: (Grid or list of lists of strings) the grid
         R: (int) radius for the neighborhood
         simil_threshold: (float) Similarity threshold
         occup_threshold: (float) Occupancy threshold
         max_steps: (int) maximum number of steps to do
-        opens: (list of tuples) a list of open locations
+        opens: (OpenLocations or list of tuples) the open locations on
+          the market, in the order they were listed, updated as
+          homeowners relocate.  Homeowners only relocate to these.
 
     Returns:
         The total number of relocations completed.
     '''
-    assert utility.is_grid(grid), ("The grid argument has the wrong type.  "
-                                   "It should be a list of lists of strings "
-                                   "with the same number of rows and columns")
+    grid = checked_grid(grid)
+
+    listed = opens
+    if not isinstance(opens, utility.OpenLocations):
+        listed = utility.OpenLocations(opens)
 
     if max_steps > 0:
-        y = step1(grid, R, simil_threshold, occup_threshold, max_steps, opens)
+        counts = NeighborhoodCounts(grid, R)
+        suitability = OpenSuitability(counts, simil_threshold,
+                                      occup_threshold, listed)
+        # The homeowners that may be unsatisfied; all the others are
+        # known to be satisfied.
+        dirty = set(get_insa(counts.codes, R, simil_threshold,
+                             occup_threshold))
+        y = step1(grid, R, simil_threshold, occup_threshold, max_steps,
+                  listed, counts, suitability, dirty)
         i = 1
         contador = y
-        while ((len(get_insa(grid, R, simil_threshold, occup_threshold))) > 0) and (i < max_steps):
+        while (prune_satisfied(dirty, counts, simil_threshold,
+                               occup_threshold) and (i < max_steps)):
             y = step1(grid, R, simil_threshold, occup_threshold, max_steps, 
-                      opens)
+                      listed, counts, suitability, dirty)
             contador = contador + y
             i += 1
     else:
         contador = 0
 
+    if listed is not opens:
+        opens[:] = listed
     return contador
 
 @click.command(name="schelling")
@@ -0,0 +1,324 @@
+'''
+Schelling Model of Housing Segregation: test code for schelling
+
+The whole-grid and indexed computations are checked against a
+reference that scans the whole city every pass and tries every
+homeowner in every open location with is_satisfied, like the original
+code.
+'''
+
+import copy
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+# Handle the fact that the grading code may not
+# be in the same directory as implementation
+sys.path.insert(0, os.getcwd())
+
+import schelling
+import utility
+
+# DO NOT REMOVE THESE LINES OF CODE
+# pylint: disable-msg= invalid-name, missing-docstring, too-many-arguments
+# pylint: disable-msg= too-many-locals
+
+
+def make_configs(seed, count):
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(count):
+        N = rng.randint(3, 12)
+        p_open = rng.choice([0.05, 0.2, 0.4])
+        grid = [["O" if rng.random() < p_open else rng.choice("BM")
+                 for _ in range(N)] for _ in range(N)]
+        # is_satisfied needs the neighborhood to fit inside the grid on
+        # at least one side.
+        R = rng.randint(0, (N - 1) // 2)
+        configs.append((grid, R, rng.choice([0.2, 0.44, 0.5, 0.6, 0.75]),
+                        rng.choice([0.3, 0.5, 0.7, 0.9]), rng.randint(1, 6)))
+    return configs
+
+
+CONFIGS = make_configs(0, 60)
+
+
+def scan_unsatisfied(grid, R, simil_threshold, occup_threshold):
+    return [(i, j) for i, row in enumerate(grid) for j, home in enumerate(row)
+            if home != "O" and not schelling.is_satisfied(
+                grid, R, (i, j), simil_threshold, occup_threshold)]
+
+
+def scan_step(grid, R, simil_threshold, occup_threshold, opens):
+    relocations = 0
+    for i, s in [(i, s) for i in range(len(grid)) for s in range(len(grid))]:
+        if grid[i][s] == "O" or schelling.is_satisfied(
+                grid, R, (i, s), simil_threshold, occup_threshold):
+            continue
+        homes = []
+        for home in opens:
+            grid[home[0]][home[1]], grid[i][s] = grid[i][s], "O"
+            if schelling.is_satisfied(grid, R, home, simil_threshold,
+                                      occup_threshold):
+                homes.append(home)
+            grid[i][s], grid[home[0]][home[1]] = grid[home[0]][home[1]], "O"
+        if len(homes) > 1:
+            distance = min(abs(k - i) + abs(l - s) for k, l in homes)
+            _, target = max((opens.index((k, l)), (k, l)) for k, l in homes
+                            if abs(k - i) + abs(l - s) == distance)
+            grid[target[0]][target[1]] = grid[i][s]
+            grid[i][s] = "O"
+            opens.remove(target)
+            opens.append((i, s))
+            relocations = relocations + 1
+    return relocations
+
+
+def scan_simulation(grid, R, simil_threshold, occup_threshold, max_steps,
+                    opens):
+    relocations = 0
+    for step in range(max_steps):
+        if step > 0 and not scan_unsatisfied(grid, R, simil_threshold,
+                                             occup_threshold):
+            break
+        relocations += scan_step(grid, R, simil_threshold, occup_threshold,
+                                 opens)
+    return relocations
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_get_insa(grid, R, simil, occup, max_steps):
+    expected = scan_unsatisfied(grid, R, simil, occup)
+    assert schelling.get_insa(grid, R, simil, occup) == expected
+    assert schelling.get_insa(utility.grid_to_array(grid), R, simil,
+                              occup) == expected
+
+
+def test_grid_to_array():
+    rows = [["B", "O"], ["M", "B"]]
+    assert (utility.grid_to_array(rows) == np.array([[0, 2], [1, 0]])).all()
+    assert utility.array_to_grid(utility.grid_to_array(rows)) == rows
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_step1(grid, R, simil, occup, max_steps):
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(utility.find_opens(grid))
+    expected = scan_step(expected_grid, R, simil, occup, expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = list(utility.find_opens(grid))
+    assert schelling.step1(sim_grid, R, simil, occup, max_steps,
+                           opens) == expected
+    assert (sim_grid, opens) == (expected_grid, expected_opens)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS[:30])
+def test_neighborhood_counts(grid, R, simil, occup, max_steps):
+    grid = copy.deepcopy(grid)
+    counts = schelling.NeighborhoodCounts(grid, R)
+    rng = random.Random(len(grid) * 100 + R)
+    for _ in range(5):
+        opens = list(utility.find_opens(grid))
+        homes = [(i, j) for i, row in enumerate(grid)
+                 for j, home in enumerate(row) if home != "O"]
+        if not opens or not homes:
+            break
+        location, target = rng.choice(homes), rng.choice(opens)
+        for home in opens:
+            expected = schelling.house_satis(grid, R, simil, occup, [home],
+                                             *location) == [home]
+            assert counts.would_be_satisfied(location, home, simil,
+                                             occup) == expected
+        counts.move(location, target)
+        grid[target[0]][target[1]] = grid[location[0]][location[1]]
+        grid[location[0]][location[1]] = "O"
+        for i, j in homes:
+            if grid[i][j] != "O":
+                assert counts.is_satisfied((i, j), simil, occup) == \
+                    schelling.is_satisfied(grid, R, (i, j), simil, occup)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS[:30])
+def test_house_satis(grid, R, simil, occup, max_steps):
+    grid = copy.deepcopy(grid)
+    opens = list(utility.find_opens(grid))
+    counts = schelling.NeighborhoodCounts(grid, R)
+    suitability = schelling.OpenSuitability(counts, simil, occup, opens)
+    rng = random.Random(len(grid) * 100 + R)
+    for _ in range(5):
+        unsatisfied = scan_unsatisfied(grid, R, simil, occup)
+        for i, s in unsatisfied:
+            expected = sorted(schelling.house_satis(grid, R, simil, occup,
+                                                    opens, i, s))
+            assert sorted(schelling.house_satis(
+                grid, R, simil, occup, opens, i, s, counts=counts)) == \
+                expected
+            assert sorted(schelling.house_satis(
+                grid, R, simil, occup, opens, i, s,
+                suitability=suitability)) == expected
+            assert suitability.count_candidates((i, s)) == len(expected)
+        if not unsatisfied or not opens:
+            break
+        # Move someone and check the index is kept up to date.
+        location, target = rng.choice(unsatisfied), rng.choice(opens)
+        counts.move(location, target)
+        suitability.update(location, target)
+        grid[target[0]][target[1]] = grid[location[0]][location[1]]
+        grid[location[0]][location[1]] = "O"
+        opens.remove(target)
+        opens.append(location)
+        for code, flags in suitability.flags.items():
+            assert suitability.suitable[code] == \
+                set(map(tuple, np.argwhere(flags).tolist()))
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS[:30])
+def test_step1_some_opens(grid, R, simil, occup, max_steps):
+    rng = random.Random(len(grid) * 100 + R)
+    some_opens = [home for home in utility.find_opens(grid)
+                  if rng.random() < 0.5]
+
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(some_opens)
+    expected = scan_step(expected_grid, R, simil, occup, expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = list(some_opens)
+    assert schelling.step1(sim_grid, R, simil, occup, max_steps,
+                           opens) == expected
+    assert (sim_grid, opens) == (expected_grid, expected_opens)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_nearest_candidates(grid, R, simil, occup, max_steps):
+    opens = list(utility.find_opens(grid))
+    counts = schelling.NeighborhoodCounts(grid, R)
+    suitability = schelling.OpenSuitability(counts, simil, occup, opens)
+    for i, s in scan_unsatisfied(grid, R, simil, occup):
+        homes = schelling.house_satis(grid, R, simil, occup, opens, i, s)
+        expected = []
+        if homes:
+            distance = min(abs(k - i) + abs(l - s) for k, l in homes)
+            expected = [(k, l) for k, l in homes
+                        if abs(k - i) + abs(l - s) == distance]
+        assert sorted(suitability.nearest_candidates((i, s))) == \
+            sorted(expected)
+
+
+def test_open_locations():
+    opens = utility.OpenLocations([(0, 1), (2, 2), (1, 0)])
+    expected = [(0, 1), (2, 2), (1, 0)]
+    opens.remove((2, 2))
+    expected.remove((2, 2))
+    opens.append([2, 2])
+    expected.append((2, 2))
+    assert opens == expected and len(opens) == 3 and (1, 0) in opens
+    candidates = [(1, 0), (0, 1)]
+    assert opens.most_recent(candidates) == \
+        max(candidates, key=expected.index)
+    with pytest.raises(ValueError):
+        opens.remove((3, 3))
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_step1_open_locations(grid, R, simil, occup, max_steps):
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(utility.find_opens(grid))
+    expected = scan_step(expected_grid, R, simil, occup, expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = utility.find_opens(sim_grid)
+    assert isinstance(opens, utility.OpenLocations)
+    assert schelling.step1(sim_grid, R, simil, occup, max_steps,
+                           opens) == expected
+    assert (sim_grid, list(opens)) == (expected_grid, expected_opens)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_do_simulation(grid, R, simil, occup, max_steps):
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(utility.find_opens(grid))
+    expected = scan_simulation(expected_grid, R, simil, occup, max_steps,
+                               expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = list(utility.find_opens(grid))
+    assert schelling.do_simulation(sim_grid, R, simil, occup, max_steps,
+                                   opens) == expected
+    assert (sim_grid, opens) == (expected_grid, expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = utility.find_opens(sim_grid)
+    assert schelling.do_simulation(sim_grid, R, simil, occup, max_steps,
+                                   opens) == expected
+    assert (sim_grid, list(opens)) == (expected_grid, expected_opens)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS[:30])
+def test_do_simulation_some_opens(grid, R, simil, occup, max_steps):
+    rng = random.Random(len(grid) * 100 + R)
+    some_opens = [home for home in utility.find_opens(grid)
+                  if rng.random() < 0.5]
+
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(some_opens)
+    expected = scan_simulation(expected_grid, R, simil, occup, max_steps,
+                               expected_opens)
+
+    sim_grid = copy.deepcopy(grid)
+    opens = list(some_opens)
+    assert schelling.do_simulation(sim_grid, R, simil, occup, max_steps,
+                                   opens) == expected
+    assert (sim_grid, opens) == (expected_grid, expected_opens)
+
+
+@pytest.mark.parametrize("grid,R,simil,occup,max_steps", CONFIGS)
+def test_grid_input(grid, R, simil, occup, max_steps):
+    expected = scan_unsatisfied(grid, R, simil, occup)
+    assert schelling.get_insa(utility.Grid(grid), R, simil, occup) == expected
+
+    expected_grid = copy.deepcopy(grid)
+    expected_opens = list(utility.find_opens(grid))
+    expected = scan_simulation(expected_grid, R, simil, occup, max_steps,
+                               expected_opens)
+    sim_grid = utility.Grid(copy.deepcopy(grid))
+    opens = utility.find_opens(sim_grid)
+    assert schelling.do_simulation(sim_grid, R, simil, occup, max_steps,
+                                   opens) == expected
+    assert (sim_grid, list(opens)) == (expected_grid, expected_opens)
+
+
+def test_grid():
+    rows = [["B", "O"], ["M", "B"]]
+    grid = utility.Grid(rows)
+    assert grid == rows and grid[0] is rows[0]
+    assert utility.is_grid(grid)
+    assert schelling.checked_grid(grid) is grid
+    assert schelling.checked_grid(rows) == rows
+    for bad in [[["B", "O"], ["M"]], [["B", "X"], ["M", "B"]], []]:
+        with pytest.raises(ValueError):
+            utility.Grid(bad)
+    for bad in [[["B", "O"], ["M"]], [["B", "X"], ["M", "B"]], [],
+                (["B"],), [[["B"]]]]:
+        with pytest.raises(AssertionError, match="wrong type"):
+            schelling.checked_grid(bad)
+    # Large grids are checked for their values too.
+    big = [["B"] * 30 for _ in range(30)]
+    big[29][29] = "X"
+    with pytest.raises(AssertionError):
+        schelling.checked_grid(big)
+    with pytest.raises(AssertionError):
+        schelling.do_simulation([["B", "O"], ["M"]], 1, 0.5, 0.5, 1, [(0, 1)])
+
+
+def test_read_grid(tmp_path):
+    filename = str(tmp_path / "grid.txt")
+    with open(filename, "w") as f:
+        f.write("B O M\nM B O\nO O B\n")
+    grid = utility.read_grid(filename)
+    assert isinstance(grid, utility.Grid)
+    assert grid == [["B", "O", "M"], ["M", "B", "O"], ["O", "O", "B"]]
@@ -8,8 +8,20 @@ import csv
 import os
 import sys
 
+import numpy as np
+
 ALLOWED_VALUES = ("B", "M", "O")
 
+# In array form, each home holds the index of its value in
+# ALLOWED_VALUES.
+OPEN_CODE = ALLOWED_VALUES.index("O")
+HOMEOWNER_CODES = tuple(code for code, value in enumerate(ALLOWED_VALUES)
+                        if value != "O")
+# The code of every one-letter value, indexed by its byte.
+_LETTER_CODES = np.zeros(256, dtype=np.uint8)
+_LETTER_CODES[[ord(value) for value in ALLOWED_VALUES]] = range(
+    len(ALLOWED_VALUES))
+
 def check_row(N, row, i, allowed=ALLOWED_VALUES):
     '''
     Check the format of ith row.
@@ -36,7 +48,7 @@ def read_grid(filename, allowed=ALLOWED_VALUES):
     Inputs:
         filename: (string) the name of the grid file to read
 
-    Returns: (list of list of strings) the grid contained in file f.
+    Returns: (Grid) the grid contained in file f.
     '''
 
     if not os.path.isfile(filename):
@@ -65,7 +77,115 @@ def read_grid(filename, allowed=ALLOWED_VALUES):
             print("File is empty")
             sys.exit(0)
 
-        return grid
+        try:
+            return Grid(grid, allowed)
+        except ValueError as e:
+            print(e)
+            sys.exit(0)
+
+
+class Grid(list):
+    '''
+    A grid that has been checked, once, to be a list of N lists of N
+    allowed values.  It is used like any other grid; as long as its
+    homes are only ever set to allowed values it stays valid, so is_grid
+    accepts it without checking it again.
+    '''
+
+    def __init__(self, rows, allowed=ALLOWED_VALUES):
+        '''
+        Check a grid and wrap it.  The rows are not copied, so changes
+        to the homes of either grid show in both.
+
+        Inputs:
+            rows: (list of lists of strings) the grid
+            allowed: (list of strings) the values the homes may take
+        '''
+        super().__init__(rows)
+        self.allowed = allowed
+        N = len(self)
+        if N == 0:
+            raise ValueError("Grid is empty")
+        for i, row in enumerate(self):
+            if not isinstance(row, list) or len(row) != N:
+                raise ValueError("Grid row {} is not a list of length {}"
+                                 .format(i, N))
+            if not set(row) <= set(allowed):
+                raise ValueError("Grid row {} has an entry other than {}"
+                                 .format(i, "/".join(allowed)))
+
+
+class OpenLocations:
+    '''
+    The open locations of a grid, in the order they were put on the
+    market, like a list of locations where new ones are appended.
+
+    Each location is kept in a dictionary, which remembers the order
+    locations were added in, with the time it was listed, so adding and
+    removing a location take constant time and the most recently listed
+    of some candidates is found without scanning the whole market.
+    '''
+
+    def __init__(self, locations=()):
+        '''
+        Inputs:
+            locations: (iterable of pairs) open locations, from the
+              longest on the market to the most recently listed
+        '''
+        self._listed = {}
+        self._clock = 0
+        for location in locations:
+            self.append(location)
+
+    def append(self, location):
+        '''
+        List a location on the market, as the most recent one.
+
+        Inputs:
+            location: (int, int) the open location
+        '''
+        location = tuple(location)
+        self._listed.pop(location, None)
+        self._listed[location] = self._clock
+        self._clock = self._clock + 1
+
+    def remove(self, location):
+        '''
+        Take a location off the market.
+
+        Inputs:
+            location: (int, int) an open location
+        '''
+        try:
+            del self._listed[tuple(location)]
+        except KeyError:
+            raise ValueError("{} is not open".format(location)) from None
+
+    def most_recent(self, candidates):
+        '''
+        Find the candidate with the least time on the market.
+
+        Inputs:
+            candidates: (list of pairs) open locations
+
+        Returns: (int, int) the most recently listed candidate
+        '''
+        return max(candidates, key=self._listed.__getitem__)
+
+    def __len__(self):
+        return len(self._listed)
+
+    def __iter__(self):
+        return iter(self._listed)
+
+    def __contains__(self, location):
+        return tuple(location) in self._listed
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "OpenLocations({})".format(list(self))
 
 
 def find_opens(grid):
@@ -75,11 +195,11 @@ def find_opens(grid):
     Inputs:
         grid: the grid
 
-    Returns a list with the open locations.
+    Returns an OpenLocations with the open locations, row by row.
     '''
 
     grid_size = len(grid)
-    open_locations = []
+    open_locations = OpenLocations()
 
     for i in range(grid_size):
         for j in range(grid_size):
@@ -89,11 +209,51 @@ def find_opens(grid):
     return open_locations
 
 
+def grid_to_array(grid):
+    '''
+    Convert a grid into its array form.  When every home holds one
+    letter, as in any valid grid, the homes are converted all at once
+    as the bytes of a single string.
+
+    Inputs:
+        grid: (list of lists of strings) the grid
+
+    Returns: (2-D NumPy array of uint8) the index in ALLOWED_VALUES of
+    the value of each home.
+    '''
+    N = len(grid)
+    text = "".join(["".join(row) for row in grid])
+    if len(text) == N * N and text.isascii():
+        letters = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+        return _LETTER_CODES[letters].reshape(N, N)
+
+    values = np.array(grid, dtype=str)
+    codes = np.zeros(values.shape, dtype=np.uint8)
+    for code, value in enumerate(ALLOWED_VALUES):
+        codes[values == value] = code
+
+    return codes
+
+
+def array_to_grid(codes):
+    '''
+    Convert a grid in array form back into a list of lists of strings.
+
+    Inputs:
+        codes: (2-D NumPy array) the index in ALLOWED_VALUES of the value
+          of each home
+
+    Returns: (list of lists of strings) the grid
+    '''
+    return [[ALLOWED_VALUES[code] for code in row] for row in codes.tolist()]
+
+
 def is_grid(grid):
     '''
     Verify that grid is a list (length N) where each element is a list
     of length N.  For smaller grids, check that the rows contain the
-    allowed values.
+    allowed values.  A Grid was checked when it was made and is not
+    checked again.
 
     Inputs:
         grid: (list of lists of strings)
@@ -103,6 +263,9 @@ def is_grid(grid):
     '''
     max_small_grid = 20
 
+    if isinstance(grid, Grid) and set(grid.allowed) <= set(ALLOWED_VALUES):
+        return True
+
     if not isinstance(grid, list):
         return False
 